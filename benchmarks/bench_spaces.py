@@ -0,0 +1,167 @@
+"""Benchmarks for the /spaces query and render paths on synthetic booking data.
+
+Generates `events` datasets of various sizes spread over many venues, loads them into an
+in-memory fake firestore client, and times `Spaces._events_between`, `Spaces._format_events`
+and every /spaces sub-command end to end with mocked telegram updates.
+
+Latency percentiles are reported per case along with the number of firestore documents read.
+Peak memory is measured separately (tracemalloc slows everything down) over seeding the source
+and one pass of every case.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_spaces [--sizes 1000 10000 100000] [--sources index range days sqlite]
+"""
+import argparse
+from datetime import datetime, timedelta
+import logging
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytz
+
+from benchmarks.fake_firestore import FakeClient
+from cinnabot.spaces import Spaces, FirestoreEventSource, days_covered
+from cinnabot.sqlite_events import SQLiteEventSource
+
+SOURCES = ['index', 'range', 'days', 'sqlite']
+
+
+def make_events(size, venues=40, days_before=30, days_after=120, seed=0):
+    """Returns `size` synthetic event documents keyed by id, spread over a semester."""
+    rng = random.Random(seed)
+    venue_names = [f'Venue {i:02d}' for i in range(venues)]
+    now = pytz.UTC.localize(datetime.utcnow())
+    span = (days_before + days_after) * 24 * 4   # quarter hours
+
+    events = dict()
+    for i in range(size):
+        start = now - timedelta(days=days_before) + timedelta(minutes=15 * rng.randrange(span))
+        end = start + timedelta(minutes=30 * rng.randint(1, 12))
+        events[f'event{i}'] = {
+            'name': f'Booking {i}',
+            'venueName': rng.choice(venue_names),
+            'startDate': start,
+            'endDate': end,
+            'daysCovered': days_covered(start, end),
+            'description': 'Lorem ipsum dolor sit amet. ' * rng.randint(1, 20),
+        }
+    return events
+
+
+def make_source(name, client, tmpdir):
+    """Builds and seeds the event source being benchmarked."""
+    if name == 'index':
+        source = FirestoreEventSource(client)
+    elif name == 'range':
+        source = FirestoreEventSource(client, use_index=False)
+    elif name == 'days':
+        # Every synthetic event carries daysCovered, as if backfilled after the last one was booked
+        collection, document = FirestoreEventSource.BACKFILL_MARKER
+        client.collection(collection).document(document).set({'backfilledAt': pytz.UTC.localize(datetime.max)})
+        source = FirestoreEventSource(client, use_index=False, query_strategy=FirestoreEventSource.DAY_BUCKET_QUERY)
+    elif name == 'sqlite':
+        source = SQLiteEventSource(client, path=os.path.join(tmpdir, f'events-{time.monotonic_ns()}.sqlite3'))
+    else:
+        raise ValueError(f'Unknown source {name!r}')
+    source.start()
+    return source
+
+
+def make_cases(spaces):
+    """Returns (name, function) pairs for every benchmarked path."""
+    now = datetime.utcnow()
+    today = datetime(now.year, now.month, now.day)
+    week_later = today + timedelta(days=7)
+    tomorrow = (today + timedelta(days=1)).strftime('%d/%m/%y')
+    fortnight = (today + timedelta(days=14)).strftime('%d/%m/%y')
+    venue = 'Venue 07'
+    week_events = spaces._events_between(today, week_later)
+
+    def command(*args):
+        def run():
+            update = MagicMock()
+            spaces.dispatch(update, SimpleNamespace(args=list(args)))
+        return run
+
+    return [
+        ('_events_between today', lambda: spaces._events_between(today, today + timedelta(days=1))),
+        ('_events_between week', lambda: spaces._events_between(today, week_later)),
+        ('_format_events week', lambda: spaces._format_events(week_events)),
+        ('/spaces', command()),
+        ('/spaces now', command('now')),
+        ('/spaces week', command('week')),
+        ('/spaces dd/mm/yy', command(tomorrow)),
+        ('/spaces dd/mm/yy dd/mm/yy', command(tomorrow, fortnight)),
+        ('/spaces venue', command('venue', venue)),
+        ('/spaces free', command('free', venue, tomorrow)),
+    ]
+
+
+def percentile(samples, q):
+    """Nearest-rank percentile of a sorted list."""
+    return samples[min(len(samples) - 1, int(q / 100 * len(samples)))]
+
+
+def run(size, source_name, repeat, warm, tmpdir):
+    """Benchmarks one dataset size against one event source and prints the results."""
+    documents = make_events(size)
+
+    # Memory: seeding plus one pass over every case
+    tracemalloc.start()
+    client = FakeClient(documents)
+    spaces = Spaces(source=make_source(source_name, client, tmpdir))
+    for _, case in make_cases(spaces):
+        case()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # Latency
+    client = FakeClient(documents)
+    seed_start = time.perf_counter()
+    spaces = Spaces(source=make_source(source_name, client, tmpdir))
+    seed_time = time.perf_counter() - seed_start
+    seed_reads = client.reads
+
+    print(f'\n{size} events, {source_name} source: seeded in {seed_time * 1000:.1f}ms '
+          f'({seed_reads} reads), peak memory {peak / 2**20:.1f}MiB')
+    print(f'{"case":<28}{"p50 ms":>10}{"p90 ms":>10}{"p99 ms":>10}{"reads":>10}')
+    for name, case in make_cases(spaces):
+        samples = list()
+        client.reads = 0
+        for _ in range(repeat):
+            if not warm:
+                spaces.invalidate_cache()
+            start = time.perf_counter()
+            case()
+            samples.append(time.perf_counter() - start)
+        samples.sort()
+        print(
+            f'{name:<28}'
+            f'{percentile(samples, 50) * 1000:>10.2f}'
+            f'{percentile(samples, 90) * 1000:>10.2f}'
+            f'{percentile(samples, 99) * 1000:>10.2f}'
+            f'{client.reads // repeat:>10}'
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--sources', nargs='+', choices=SOURCES, default=SOURCES)
+    parser.add_argument('--repeat', type=int, default=20, help='timed runs per case')
+    parser.add_argument('--warm', action='store_true', help='keep the response cache between runs')
+    args = parser.parse_args()
+
+    # The bot logs every query at INFO
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in args.sizes:
+            for source_name in args.sources:
+                run(size, source_name, args.repeat, args.warm, tmpdir)
@@ -0,0 +1,111 @@
+"""A minimal in-memory stand-in for `google.cloud.firestore.Client`, for benchmarks.
+
+Only the parts of the API that /spaces uses are implemented: `collection().where()`,
+`select()`, `stream()`, `get()` and `on_snapshot()` on events, and `collection().document().get()`
+on the other collections. Filters are evaluated with a full scan,
+like firestore bills us, and every document read is counted in `FakeClient.reads`.
+"""
+from collections import namedtuple
+import operator
+from types import SimpleNamespace
+
+ChangeType = namedtuple('ChangeType', ['name'])
+DocumentChange = namedtuple('DocumentChange', ['type', 'document'])
+
+ADDED = ChangeType('ADDED')
+
+OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '>=': operator.ge,
+    '>': operator.gt,
+    'array_contains': lambda values, value: value in (values or ()),
+    'array_contains_any': lambda values, options: bool(set(values or ()) & set(options)),
+}
+
+
+class FakeSnapshot:
+    """A document snapshot exposing `id`, `get(field)` and `to_dict()`."""
+
+    __slots__ = ('id', '_data')
+
+    def __init__(self, id, data):
+        self.id = id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def get(self, field):
+        return self._data[field]
+
+    def to_dict(self):
+        return None if self._data is None else dict(self._data)
+
+
+class FakeWatch:
+    def unsubscribe(self):
+        return
+
+
+class FakeQuery:
+    """An immutable query over a FakeClient's documents."""
+
+    def __init__(self, client, filters=(), fields=None):
+        self.client = client
+        self.filters = tuple(filters)
+        self.fields = fields
+
+    def where(self, field, op, value):
+        return FakeQuery(self.client, self.filters + ((field, OPERATORS[op], value),), self.fields)
+
+    def select(self, fields):
+        return FakeQuery(self.client, self.filters, list(fields))
+
+    def stream(self):
+        for doc_id, data in self.client.documents.items():
+            if all(field in data and op(data[field], value) for field, op, value in self.filters):
+                self.client.reads += 1
+                if self.fields is not None:
+                    data = {field: data[field] for field in self.fields if field in data}
+                yield FakeSnapshot(doc_id, data)
+
+    def get(self):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        """Delivers the initial snapshot immediately. No further changes are ever pushed."""
+        documents = self.get()
+        callback(documents, [DocumentChange(ADDED, document) for document in documents], None)
+        return FakeWatch()
+
+
+class FakeDocument:
+    """A reference to a single document outside the events collection."""
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+
+    def get(self):
+        self.client.reads += 1
+        return FakeSnapshot(self.path[1], self.client.other_documents.get(self.path))
+
+    def set(self, data):
+        self.client.other_documents[self.path] = dict(data)
+
+
+class FakeClient:
+    """Holds every document of the `events` collection, and a few others, in memory."""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.other_documents = dict()   # (collection, document id) -> data
+        self.reads = 0
+
+    def collection(self, name):
+        if name != 'events':
+            return SimpleNamespace(document=lambda document_id: FakeDocument(self, (name, document_id)))
+        return FakeQuery(self)
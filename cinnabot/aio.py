@@ -0,0 +1,139 @@
+"""Runs coroutine handler callbacks on an asyncio event loop.
+
+python-telegram-bot 13 calls every handler on the dispatcher thread, one update at a time.
+A coroutine callback is instead scheduled on `runtime`, an event loop running in a background
+thread, and PTB gets a `Promise` for its result straight away, so the dispatcher moves on to the
+next update while up to `max_concurrency` callbacks are in flight. `ConversationHandler`
+already knows to wait on a Promise for the next state.
+
+Blocking work (telegram requests, firestore reads) is awaited through `to_thread`, which runs it
+on the runtime's thread pool instead of stalling the loop.
+
+Until `runtime.start()` is called, coroutine callbacks are run to completion on the calling
+thread without an event loop, and `to_thread` makes its call right away, which behaves exactly
+like a synchronous handler. Callbacks must then await nothing but `to_thread`.
+
+    class Example(Command):
+        async def callback(self, update, context):
+            await to_thread(update.message.reply_text, 'Hi!')
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import inspect
+import logging
+import threading
+
+from telegram import Update
+from telegram.utils.promise import Promise
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRuntime:
+    """An asyncio event loop in a background thread that runs coroutine callbacks."""
+
+    def __init__(self):
+        self.max_concurrency = None
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._loop is not None
+
+    def start(self, max_concurrency: int = 32):
+        """Starts the event loop, allowing at most max_concurrency callbacks at once."""
+        with self._lock:
+            if self._loop is not None:
+                return
+            self.max_concurrency = max_concurrency
+            loop = asyncio.new_event_loop()
+            loop.set_default_executor(ThreadPoolExecutor(max_concurrency, thread_name_prefix='cinnabot-io'))
+            self._semaphore = asyncio.Semaphore(max_concurrency)
+            self._thread = threading.Thread(target=loop.run_forever, name='cinnabot-asyncio', daemon=True)
+            self._thread.start()
+            self._loop = loop
+            logger.info(f'Running coroutine handlers concurrently, at most {max_concurrency} at once')
+
+    def stop(self):
+        """Stops the event loop after the callbacks in flight finish."""
+        with self._lock:
+            loop, self._loop = self._loop, None
+            if loop is None:
+                return
+            loop.call_soon_threadsafe(loop.stop)
+            self._thread.join()
+            loop.run_until_complete(loop.shutdown_default_executor())
+            loop.close()
+
+    def submit(self, coroutine, update: Update = None):
+        """Schedules a callback's coroutine, returning a Promise for its result.
+
+        If the runtime is not running, the coroutine is run to completion right away and its
+        result is returned instead.
+        """
+        if self._loop is None:
+            return self._run_inline(coroutine)
+
+        future = asyncio.run_coroutine_threadsafe(self._limited(coroutine), self._loop)
+        promise = Promise(future.result, (), {}, update=update)
+        future.add_done_callback(lambda _: self._settle(promise))
+        return promise
+
+    async def _limited(self, coroutine):
+        async with self._semaphore:
+            return await coroutine
+
+    @staticmethod
+    def _run_inline(coroutine):
+        """Runs a coroutine that never suspends on the calling thread, returning its result."""
+        try:
+            coroutine.send(None)
+        except StopIteration as e:
+            return e.value
+        coroutine.close()
+        raise RuntimeError('Coroutine handlers may only await to_thread until the runtime is started')
+
+    @staticmethod
+    def _settle(promise: Promise):
+        """Resolves a Promise with its finished future's result."""
+        promise.run()
+        if promise.exception is not None:
+            logger.error('Coroutine handler raised an exception', exc_info=promise.exception)
+
+
+# Shared by every feature
+runtime = AsyncRuntime()
+
+
+async def to_thread(function, *args, **kwargs):
+    """Awaits a blocking call made on the runtime's thread pool, or makes it right away outside of it."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return function(*args, **kwargs)
+    return await loop.run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+
+def asynchronous(callback):
+    """Lets PTB call a coroutine callback like a synchronous one, through `runtime`.
+
+    Use this on callbacks passed to handlers directly, like a Conversation's states.
+    Command.callback coroutines are handled without it.
+    """
+    if not inspect.iscoroutinefunction(callback):
+        raise TypeError(f'{callback.__name__} is not a coroutine function')
+
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        update = next((arg for arg in args if isinstance(arg, Update)), None)
+        return runtime.submit(callback(*args, **kwargs), update)
+    return wrapper
@@ -0,0 +1,247 @@
+"""Static images the bot sends: optimized copies, an in-memory store and a telegram file_id cache.
+
+`resolve` maps an image path to its optimized copy from the manifest written by
+`python -m scripts.optimize_assets`, falling back to the original whenever the copy is missing
+or out of date. Originals with an optimized copy are left out of the deploy by `.slugignore`,
+so a copy is trusted as long as it matches the manifest and its original is absent.
+
+`AssetStore` reads and validates every asset once at startup, so a broken path stops the bot
+from booting instead of failing mid-conversation, and uploads never touch the disk.
+
+Telegram hands back a `file_id` for every file a bot uploads, and sending that id again costs
+no upload at all. `FileIdCache` remembers the id for each asset, keyed by its path and a hash
+of its contents so edited files are uploaded afresh, and persists the ids to a JSON file so they
+survive restarts.
+"""
+from contextlib import ExitStack
+import hashlib
+import io
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+
+from PIL import Image
+from telegram import Bot, InputMediaPhoto, Message
+from telegram.error import BadRequest
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO,
+)
+
+logger = logging.getLogger(__name__)
+
+# Where the images live, and where scripts.optimize_assets puts their optimized copies
+ASSET_DIRS = [Path('cinnabot', 'claims'), Path('cinnabot', 'maps')]
+OPTIMIZED_DIR = Path('cinnabot', 'optimized')
+MANIFEST_PATH = OPTIMIZED_DIR / 'manifest.json'
+
+_manifest = None
+
+
+def resolve(path):
+    """Returns the optimized copy of an image if the manifest has a current one, else path."""
+    global _manifest
+    if _manifest is None:
+        _manifest = _load_manifest()
+    return _manifest.get(Path(path).as_posix(), Path(path))
+
+
+def _load_manifest():
+    """Reads the asset manifest, keeping only entries whose copy, and source if present, are unchanged."""
+    try:
+        entries = json.loads(MANIFEST_PATH.read_text())
+    except FileNotFoundError:
+        return dict()
+    except (OSError, ValueError) as e:
+        logger.error(f'Ignoring unreadable asset manifest {MANIFEST_PATH}: {e}')
+        return dict()
+
+    manifest = dict()
+    for source, entry in entries.items():
+        try:
+            current = hashlib.sha256(Path(entry['path']).read_bytes()).hexdigest() == entry['sha256']
+            if current and Path(source).exists():
+                current = hashlib.sha256(Path(source).read_bytes()).hexdigest() == entry['source_sha256']
+        except OSError:
+            current = False
+        if current:
+            manifest[source] = Path(entry['path'])
+        else:
+            logger.warning(f'Optimized copy of {source} is out of date, sending the original')
+    return manifest
+
+
+class AssetStore:
+    """Holds the contents of every asset in memory, keyed by path."""
+
+    def __init__(self):
+        self._assets = dict()           # posix path -> (contents, sha256)
+
+    def __contains__(self, path):
+        return Path(path).as_posix() in self._assets
+
+    def load(self, assets):
+        """Reads and validates every (path, attachment type) in assets.
+
+        Raises OSError for missing files and ValueError for empty files or broken photos.
+        """
+        for path, attachment_type in assets:
+            data = Path(path).read_bytes()
+            if not data:
+                raise ValueError(f'Asset {path} is empty')
+            if attachment_type == 'photo':
+                try:
+                    Image.open(io.BytesIO(data)).verify()
+                except Exception as e:
+                    raise ValueError(f'Asset {path} is not a valid image: {e}') from e
+            self._assets[Path(path).as_posix()] = (data, hashlib.sha256(data).hexdigest())
+        logger.info(f'Loaded {len(self._assets)} assets ({sum(len(data) for data, _ in self._assets.values()) // 1024}KB)')
+
+    def open(self, path):
+        """Returns a fresh read-only handle on an asset, sharing the stored bytes."""
+        handle = io.BytesIO(self._assets[Path(path).as_posix()][0])
+        handle.name = Path(path).name   # telegram names uploads after this
+        return handle
+
+    def digest(self, path):
+        """Returns the sha256 of an asset's contents."""
+        return self._assets[Path(path).as_posix()][1]
+
+
+class FileIdCache:
+    """Maps '<asset path>:<sha256 of contents>' to the file_id telegram assigned on upload.
+
+    Assets in the store are hashed and uploaded from memory, anything else from disk.
+    """
+
+    def __init__(self, path: str = 'file_ids.json', store: AssetStore = None):
+        self.path = Path(path)
+        self.store = store if store is not None else AssetStore()
+        self._lock = threading.Lock()
+        self._ids = None                # key -> file_id, loaded on first use
+        self._digests = dict()          # asset path -> (mtime, size, sha256)
+
+    def send(self, asset, send, attachment_type: str, **kwargs):
+        """Sends an asset with `send(<attachment_type>=..., **kwargs)`, uploading it only once.
+
+        send is a bound method such as `message.reply_photo`, and attachment_type is one of
+        'photo', 'audio' or 'document'. Returns the sent message.
+        """
+        key = self._key(asset)
+        file_id = self._get(key)
+        if file_id is not None:
+            try:
+                return send(**{attachment_type: file_id}, **kwargs)
+            except BadRequest as e:
+                # Ids belong to one bot, so they go stale whenever the token changes
+                logger.warning(f'Cached file_id for {asset} rejected, uploading again: {e}')
+
+        with self._open(asset) as attachment:
+            message = send(**{attachment_type: attachment}, **kwargs)
+        self._put(key, self._file_id(message, attachment_type))
+        return message
+
+    def send_photos(self, photos, send_media_group, **kwargs):
+        """Sends (path, caption) pairs as one album with `send_media_group(media=..., **kwargs)`.
+
+        Telegram albums hold 2 to 10 photos. Returns the sent messages.
+        """
+        keys = [self._key(path) for path, _ in photos]
+        ids = [self._get(key) for key in keys]
+        try:
+            messages = self._send_album(photos, ids, send_media_group, **kwargs)
+        except BadRequest as e:
+            if not any(ids):
+                raise
+            logger.warning(f'Cached file_ids for an album rejected, uploading again: {e}')
+            messages = self._send_album(photos, [None] * len(photos), send_media_group, **kwargs)
+
+        for key, message in zip(keys, messages):
+            self._put(key, self._file_id(message, 'photo'))
+        return messages
+
+    def _send_album(self, photos, ids, send_media_group, **kwargs):
+        """Sends an album, uploading the photos without a file_id."""
+        with ExitStack() as files:
+            media = [
+                InputMediaPhoto(file_id or files.enter_context(self._open(path)), caption=caption)
+                for (path, caption), file_id in zip(photos, ids)
+            ]
+            return send_media_group(media=media, **kwargs)
+
+    def warm(self, bot: Bot, chat_id: int, assets):
+        """Uploads every (path, attachment type) in assets that has no file_id yet.
+
+        Each upload goes to chat_id and is deleted again right away.
+        """
+        uploaded = 0
+        for asset, attachment_type in assets:
+            if self._get(self._key(asset)) is not None:
+                continue
+            send = getattr(bot, f'send_{attachment_type}')
+            message = self.send(asset, lambda **kwargs: send(chat_id=chat_id, **kwargs), attachment_type)
+            bot.delete_message(chat_id=chat_id, message_id=message.message_id)
+            uploaded += 1
+        logger.info(f'Pre-warmed file_ids for {uploaded} assets')
+
+    def _open(self, asset):
+        if asset in self.store:
+            return self.store.open(asset)
+        return open(asset, 'rb')
+
+    def _key(self, asset):
+        """Returns the cache key of an asset, only rehashing files that changed on disk."""
+        if asset in self.store:
+            return f'{Path(asset).as_posix()}:{self.store.digest(asset)}'
+        stat = os.stat(asset)
+        cached = self._digests.get(str(asset))
+        if cached is None or cached[:2] != (stat.st_mtime_ns, stat.st_size):
+            with open(asset, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            cached = (stat.st_mtime_ns, stat.st_size, digest)
+            self._digests[str(asset)] = cached
+        return f'{Path(asset).as_posix()}:{cached[2]}'
+
+    def _get(self, key: str):
+        with self._lock:
+            return self._load().get(key)
+
+    def _put(self, key: str, file_id: str):
+        """Stores a file_id and rewrites the cache file."""
+        with self._lock:
+            ids = self._load()
+            if ids.get(key) == file_id:
+                return
+            ids[key] = file_id
+            try:
+                tmp = self.path.with_name(self.path.name + '.tmp')
+                tmp.write_text(json.dumps(ids, indent=2, sort_keys=True))
+                os.replace(tmp, self.path)
+            except OSError as e:
+                logger.error(f'Could not save file_ids to {self.path}: {e}')
+
+    def _load(self):
+        """Reads the cache file on first use. Callers must hold self._lock."""
+        if self._ids is None:
+            try:
+                self._ids = json.loads(self.path.read_text())
+            except FileNotFoundError:
+                self._ids = dict()
+            except (OSError, ValueError) as e:
+                logger.error(f'Ignoring unreadable file_id cache {self.path}: {e}')
+                self._ids = dict()
+        return self._ids
+
+    @staticmethod
+    def _file_id(message: Message, attachment_type: str):
+        if attachment_type == 'photo':
+            return message.photo[-1].file_id     # the largest size
+        return getattr(message, attachment_type).file_id
+
+
+# Shared by every feature, so each asset is loaded once per process and uploaded once per bot
+store = AssetStore()
+file_ids = FileIdCache(os.environ.get('FILE_ID_CACHE', 'file_ids.json'), store=store)
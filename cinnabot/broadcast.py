@@ -0,0 +1,127 @@
+"""Rate limited fan-out of bot-initiated messages.
+
+Telegram allows a bot roughly 30 messages per second overall and about one per second to any
+single chat, and answers with `RetryAfter` when pushed harder. Features that push messages to
+many chats queue them on a `RateLimitedSender`, which JobQueue jobs drain within those limits.
+Drain jobs are only scheduled while messages are queued, so an idle sender costs nothing.
+"""
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+from telegram.error import RetryAfter, TelegramError, Unauthorized
+from telegram.ext import CallbackContext, JobQueue
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitedSender:
+    """Queues messages per chat and sends them in batches from a job that runs while any are queued.
+
+    Messages queued for a chat before its turn comes up are merged into a single message,
+    so a burst of updates costs one request per chat instead of one per update.
+    """
+
+    # Telegram's limit on a single message
+    MAX_LENGTH = 4096
+
+    def __init__(self, max_per_second: int = 30, per_chat_interval: float = 1.0):
+        self.max_per_second = max_per_second
+        self.per_chat_interval = per_chat_interval
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()   # chat id -> list of texts, oldest chat first
+        self._last_sent = dict()        # chat id -> monotonic time of last message
+        self._paused_until = 0
+        self._interval = 1.0
+        self._job_queue = None
+        self._scheduled = False         # whether a drain job is queued
+
+    def start(self, job_queue: JobQueue, interval: float = 1.0):
+        """Drains the queue every `interval` seconds on the job queue while messages are queued."""
+        with self._lock:
+            self._interval = interval
+            self._job_queue = job_queue
+            if self._pending:
+                self._schedule(interval)
+
+    def send(self, chat_id: int, text: str):
+        """Queues a message for a chat. Safe to call from any thread."""
+        with self._lock:
+            self._pending.setdefault(chat_id, list()).append(text)
+            if not self._scheduled and self._job_queue is not None:
+                self._schedule(self._interval)
+
+    def pending(self):
+        """Returns the number of chats with queued messages."""
+        with self._lock:
+            return len(self._pending)
+
+    def _schedule(self, delay: float):
+        """Queues the next drain job. Callers must hold self._lock."""
+        self._scheduled = True
+        self._job_queue.run_once(self._drain, delay, name='broadcast')
+
+    def _drain(self, context: CallbackContext):
+        """Job callback sending as many queued batches as the rate limits allow.
+
+        Runs again after `interval` seconds, or once a flood pause is over, while messages are left.
+        """
+        try:
+            self._send_batches(context)
+        finally:
+            with self._lock:
+                self._scheduled = False
+                if self._pending:
+                    self._schedule(max(self._interval, self._paused_until - time.monotonic()))
+
+    def _send_batches(self, context: CallbackContext):
+        now = time.monotonic()
+        if now < self._paused_until:
+            return
+
+        budget = int(self.max_per_second * self._interval)
+        batches = list()
+        with self._lock:
+            for chat_id in list(self._pending):
+                if len(batches) >= budget:
+                    break
+                if now - self._last_sent.get(chat_id, 0) < self.per_chat_interval:
+                    continue
+                batches.append((chat_id, self._pending.pop(chat_id)))
+                self._last_sent[chat_id] = now
+
+        for i, (chat_id, texts) in enumerate(batches):
+            try:
+                for chunk in self._chunks(texts):
+                    context.bot.send_message(chat_id=chat_id, text=chunk, disable_web_page_preview=True)
+            except RetryAfter as e:
+                # Put back everything not sent yet and back off for as long as telegram asks
+                logger.warning(f'Flood limit hit, pausing broadcasts for {e.retry_after}s')
+                self._paused_until = time.monotonic() + e.retry_after
+                with self._lock:
+                    for chat_id, texts in reversed(batches[i:]):
+                        self._pending[chat_id] = texts + self._pending.get(chat_id, list())
+                        self._pending.move_to_end(chat_id, last=False)
+                return
+            except Unauthorized as e:
+                logger.info(f'Dropping messages for {chat_id}: {e}')
+            except TelegramError as e:
+                logger.error(f'Failed to send to {chat_id}: {e}')
+
+    def _chunks(self, texts):
+        """Merges queued texts into as few messages as fit telegram's length limit."""
+        chunk = ''
+        for text in texts:
+            text = text[:self.MAX_LENGTH]
+            if chunk and len(chunk) + 2 + len(text) > self.MAX_LENGTH:
+                yield chunk
+                chunk = ''
+            chunk = f'{chunk}\n\n{text}' if chunk else text
+        if chunk:
+            yield chunk
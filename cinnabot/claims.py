@@ -5,6 +5,7 @@ Claims.DATA[STATE]: maps user input to a list of replies for a particular state
 """
 
 # Base imports
+from collections import deque
 import logging
 from pathlib import Path
 
@@ -26,6 +27,8 @@ from telegram.ext import (
 
 # Local imports
 from cinnabot import Conversation
+from cinnabot.aio import asynchronous, to_thread
+from cinnabot.assets import file_ids, resolve
 
 # Logging config
 logging.basicConfig(
@@ -46,6 +49,10 @@ STATES = range(7)
     END,
 ) = STATES
 
+# Steps remembered for the back button, as (state, user input), with (None, None) for the entry
+HISTORY_SIZE = 16
+ENTRY = (None, None)
+
 
 class Reply:
     """Data class that handles telegram reply type according to arguments.
@@ -56,9 +63,9 @@ class Reply:
 
     def __init__(self, text: str, photo=None, audio=None, document=None, keyboard=None):
         self.text = text
-        self.photo = photo
-        self.audio = audio
-        self.document = document
+        self.photo = photo and resolve(photo)
+        self.audio = audio and resolve(audio)
+        self.document = document and resolve(document)
         self.keyboard = keyboard
 
     def _reply_with_attachment(self, message: Message, attachment_type: str):
@@ -66,15 +73,42 @@ class Reply:
         try:
             filepath = getattr(self, attachment_type)
             function = getattr(message, f'reply_{attachment_type}')
-            with open(filepath, 'rb') as attachment:
-                function(**{
-                    attachment_type: attachment,
-                    'caption': self.text,
-                })
+            file_ids.send(filepath, function, attachment_type, caption=self.text)
         except Exception as e:
             logger.error(e)
             message.reply_text(f'{self.text}:\n{attachment_type.title()} not found!')
 
+    # Telegram albums hold at most 10 photos
+    MAX_ALBUM_SIZE = 10
+
+    @classmethod
+    def reply_all(cls, replies, message: Message):
+        """Sends replies in order, grouping consecutive photos into albums of one request each."""
+        i = 0
+        while i < len(replies):
+            album = list()
+            while i < len(replies) and replies[i].photo is not None and len(album) < cls.MAX_ALBUM_SIZE:
+                album.append(replies[i])
+                i += 1
+
+            if len(album) > 1:
+                cls._reply_with_album(album, message)
+            elif album:
+                album[0].reply_to(message)
+            else:
+                replies[i].reply_to(message)
+                i += 1
+
+    @staticmethod
+    def _reply_with_album(replies, message: Message):
+        """Attempts to send photos as one album and sends them one by one if unsuccessful"""
+        try:
+            file_ids.send_photos([(reply.photo, reply.text) for reply in replies], message.reply_media_group)
+        except Exception as e:
+            logger.error(e)
+            for reply in replies:
+                reply.reply_to(message)
+
     def reply_to(self, message: Message):
         if self.photo is None and self.audio is None and self.document is None and self.keyboard is None:
             message.reply_markdown(
@@ -118,7 +152,7 @@ class Claims(Conversation):
                 CommandHandler(self.command, self.entry),
             ],
             states = {
-                state: self._make_handlers(mapping)
+                state: self._make_handlers(state, mapping)
                 for state, mapping in self.DATA.items()
             },
             fallbacks = [
@@ -129,13 +163,26 @@ class Claims(Conversation):
             per_chat = True,
             per_user = False,
             per_message = False,
+            name = self.command,
+            persistent = True,
         )
     
-    def entry(self, update: Update, context: CallbackContext, **kwargs):
-        """kwargs included for compatibility with replay=True hack"""
+    @classmethod
+    def assets(cls):
+        """Returns (path, attachment type) for every file sent by the replies in DATA."""
+        assets = list()
+        for mapping in cls.DATA.values():
+            for replies in mapping.values():
+                for reply in replies:
+                    for attachment_type in ['photo', 'audio', 'document']:
+                        path = getattr(reply, attachment_type)
+                        if path is not None and (path, attachment_type) not in assets:
+                            assets.append((path, attachment_type))
+        return assets
+
+    def entry(self, update: Update, context: CallbackContext):
         logger.info(f'{update.message.from_user.id}: "entry"')
-        context.chat_data['history'] = list()
-        context.chat_data['history'].append(self.entry)
+        context.chat_data['claims_history'] = deque([ENTRY], maxlen=HISTORY_SIZE)
         update.message.reply_text(
             text = (
                 '🤖: Welcome to Claims, your one-stop guide to finance claiming!\n'
@@ -160,11 +207,18 @@ class Claims(Conversation):
         return START
 
     def back(self, update: Update, context: CallbackContext):
-        """Delegates callback to the last recorded callback"""
-        last_callback = context.chat_data['history'].pop() # Undo wrong callback
-        last_callback = context.chat_data['history'][-1] # Replay last callback
-        next_state = last_callback(update, context, replay=True) # Skip content messages
-        return next_state
+        """Replays the step before the last one recorded in the chat's history"""
+        history = context.chat_data.get('claims_history')
+        if history:
+            history.pop() # Undo wrong callback
+
+        # Start over once the history runs out, e.g. after a restart or many steps back
+        if not history or history[-1] == ENTRY:
+            return self.entry(update, context)
+
+        state, user_input = history[-1]
+        callback = self._make_callback(state, user_input, self.DATA[state][user_input])
+        return callback(update, context, replay=True) # Skip content messages
 
     def cancel(self, update: Update, context: CallbackContext):
         """Panic button to kill claims ):"""
@@ -176,36 +230,38 @@ class Claims(Conversation):
             text = 'Sorry! I didn\'t understand you. (use /cancel to exit claims)'
         )
 
-    def _make_callback(self, user_input, replies):
-        """Constructs a callback"""
-        def callback(update: Update, context: CallbackContext, replay=False):
+    def _make_callback(self, state, user_input, replies):
+        """Constructs a callback for user_input in state"""
+        @asynchronous
+        async def callback(update: Update, context: CallbackContext, replay=False):
             logger.info(f'{update.message.from_user.id}: "{user_input}"')
 
             # Skip content messages on back command by setting `replay=True` 
             if replay:
                 selected_replies = replies[-1:]
             else:
-                context.chat_data['history'].append(callback)
+                history = context.chat_data.setdefault('claims_history', deque([ENTRY], maxlen=HISTORY_SIZE))
+                history.append((state, user_input))
                 selected_replies = replies
 
             # Send out replies and update the application state
             next_state = ConversationHandler.END
+            await to_thread(Reply.reply_all, selected_replies, update.message)
             for reply in selected_replies:
-                reply.reply_to(update.message)
                 if reply.keyboard is not None:
                     next_state = reply.keyboard
 
             return next_state
         return callback
 
-    def _make_handlers(self, mapping):
+    def _make_handlers(self, state, mapping):
         """Builds a list of handlers from chatbot data"""
         handlers = [MessageHandler(Filters.regex('Back'), self.back)]
         for user_input, replies in mapping.items():
             pattern = '^' + user_input.replace('(', r'\(').replace(')', r'\)') + '$'
             handlers.append(MessageHandler(
                 Filters.regex(pattern), 
-                self._make_callback(user_input, replies),
+                self._make_callback(state, user_input, replies),
             ))
         return handlers
 
@@ -0,0 +1,94 @@
+"""Venue occupancy heatmaps for /spaces.
+
+Bookings are binned into a venue x hour grid with prefix sums over the sorted booking
+boundaries, so the whole grid costs a couple of sorts and searches instead of a loop over
+every booking and every hour, and the grid is drawn as a PNG with Pillow.
+"""
+from datetime import datetime, timedelta
+import io
+import logging
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO,
+)
+
+logger = logging.getLogger(__name__)
+
+# Cell size in pixels, and room for the venue names and day labels
+CELL_WIDTH = 5
+CELL_HEIGHT = 16
+LABEL_WIDTH = 160
+HEADER_HEIGHT = 24
+
+FREE = np.array([255, 255, 255], dtype=np.float64)
+BOOKED = np.array([200, 30, 45], dtype=np.float64)
+GRID = (200, 200, 200)
+TEXT = (0, 0, 0)
+
+
+def occupancy(events, venues, start_time: datetime, hours: int):
+    """Returns a (venues, hours) array of the fraction of each hour each venue is booked.
+
+    Hour h covers [start_time + h hours, start_time + h + 1 hours). Overlapping bookings of
+    one venue are counted once each, so values are clipped to 1.
+    """
+    rows = {venue: row for row, venue in enumerate(venues)}
+    events = [event for event in events if event.venue in rows]
+    grid = np.zeros((len(venues), hours))
+    if not events:
+        return grid
+
+    # Booking boundaries in hours since start_time, clipped to the window and shifted so each
+    # venue gets its own stretch [row * hours, (row + 1) * hours] of one long axis
+    row = np.array([rows[event.venue] for event in events], dtype=np.float64) * hours
+    start = np.array([(event.start - start_time).total_seconds() for event in events]) / 3600
+    end = np.array([(event.end - start_time).total_seconds() for event in events]) / 3600
+    starts = np.sort(row + np.clip(start, 0, hours))
+    ends = np.sort(row + np.clip(end, 0, hours))
+
+    # Booked hours before x: sum(x - s for starts s < x) - sum(x - e for ends e < x)
+    start_sums = np.concatenate(([0], np.cumsum(starts)))
+    end_sums = np.concatenate(([0], np.cumsum(ends)))
+    x = np.arange(len(venues) * hours + 1, dtype=np.float64)
+    started = np.searchsorted(starts, x)
+    ended = np.searchsorted(ends, x)
+    booked = (x * started - start_sums[started]) - (x * ended - end_sums[ended])
+
+    grid = np.diff(booked).reshape(len(venues), hours)
+    return np.clip(grid, 0, 1)
+
+
+def render_heatmap(grid, venues, start_time: datetime):
+    """Draws an occupancy grid as PNG bytes, with a column per hour from start_time."""
+    rows, hours = grid.shape
+    width = LABEL_WIDTH + hours * CELL_WIDTH
+    height = HEADER_HEIGHT + max(rows, 1) * CELL_HEIGHT
+
+    image = Image.new('RGB', (width, height), 'white')
+    if rows:
+        # Blend every cell between the free and booked colours, then scale cells up to size
+        colours = FREE + grid[..., np.newaxis] * (BOOKED - FREE)
+        cells = Image.fromarray(colours.round().astype(np.uint8), 'RGB')
+        cells = cells.resize((hours * CELL_WIDTH, rows * CELL_HEIGHT), Image.NEAREST)
+        image.paste(cells, (LABEL_WIDTH, HEADER_HEIGHT))
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+
+    for row, venue in enumerate(venues):
+        y = HEADER_HEIGHT + row * CELL_HEIGHT
+        draw.line([(0, y), (width, y)], fill=GRID)
+        draw.text((4, y + 2), venue[:26], fill=TEXT, font=font)
+
+    for hour in range(0, hours, 24):
+        x = LABEL_WIDTH + hour * CELL_WIDTH
+        day = start_time + timedelta(hours=hour)
+        draw.line([(x, 0), (x, height)], fill=TEXT)
+        draw.text((x + 4, 6), day.strftime('%a %d/%m'), fill=TEXT, font=font)
+
+    png = io.BytesIO()
+    image.save(png, format='PNG', optimize=True)
+    return png.getvalue()
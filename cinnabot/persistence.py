@@ -0,0 +1,316 @@
+"""A SQLite persistence backend for chat, user, bot and conversation state.
+
+`PicklePersistence` rewrites its whole file on every flush and loads every chat ever seen at
+startup. `SQLitePersistence` keeps one pickled row per chat and user instead:
+
+- Rows are only queued for writing when their pickle differs from what is stored.
+- Queued rows are written in a single transaction every `flush_interval` seconds.
+- Chat and user data are loaded lazily, the first time a chat or user is seen after a restart.
+- Subscriptions (such as /spaces subscribe) are one row per chat, saved as they change instead
+  of with bot_data, which PTB would otherwise copy and pickle after every update.
+- PTB saves every chat and user loaded since the restart after each job. `IncrementalDispatcher`
+  only saves the ones used since its last save instead.
+
+So the cost of persisting follows how many chats are active, not how many have ever existed.
+"""
+from collections import defaultdict
+import hashlib
+import json
+import logging
+import pickle
+from queue import Queue
+import sqlite3
+import threading
+
+from telegram import Bot, Update
+from telegram.ext import BasePersistence, Dispatcher, JobQueue, Updater
+from telegram.utils.promise import Promise
+from telegram.utils.request import Request
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO,
+)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS chat_data (
+    id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_data (
+    id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bot_data (
+    id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state BLOB NOT NULL,
+    PRIMARY KEY (name, key)
+);
+CREATE TABLE IF NOT EXISTS subscriptions (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    PRIMARY KEY (name, key, chat_id)
+);
+'''
+
+# Subscription rows have no data, so every stored or queued one has this digest
+SUBSCRIBED = hashlib.sha1(b'').digest()
+
+
+class _LazyData(defaultdict):
+    """A defaultdict(dict) that loads missing entries with `load(key)` on first access.
+
+    Keys looked up with `data[key]` are remembered until `take_touched()`.
+    """
+
+    def __init__(self, load):
+        super().__init__(dict)
+        self._load = load
+        self._touched = set()
+        self._touched_lock = threading.Lock()
+
+    def __getitem__(self, key):
+        with self._touched_lock:
+            self._touched.add(key)
+        return super().__getitem__(key)
+
+    def __missing__(self, key):
+        value = self._load(key)
+        self[key] = value
+        return value
+
+    def take_touched(self):
+        """Returns the keys looked up since the last call."""
+        with self._touched_lock:
+            touched, self._touched = self._touched, set()
+        return touched
+
+
+class SQLitePersistence(BasePersistence):
+    """Persists bot state to a SQLite file, writing only what changed, in timed batches."""
+
+    def __init__(self, path: str = 'cinnabot.sqlite3', flush_interval: float = 5.0, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()           # guards the connection and the dirty rows
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self._dirty = dict()                    # (table, key) -> pickled row, or None to delete it
+        self._digests = dict()                  # (table, key) -> sha1 of the row stored or queued
+        self._chat_data = None
+        self._user_data = None
+        self._stopped = threading.Event()
+        self._flusher = None
+
+    def get_chat_data(self):
+        if self._chat_data is None:
+            self._chat_data = _LazyData(lambda chat_id: self._load('chat_data', chat_id))
+        return self._chat_data
+
+    def get_user_data(self):
+        if self._user_data is None:
+            self._user_data = _LazyData(lambda user_id: self._load('user_data', user_id))
+        return self._user_data
+
+    def get_bot_data(self):
+        return self._load('bot_data', 0)
+
+    def get_conversations(self, name: str):
+        with self._lock:
+            rows = self._conn.execute('SELECT key, state FROM conversations WHERE name = ?', (name,)).fetchall()
+        conversations = dict()
+        for key, state in rows:
+            self._digests[('conversations', (name, key))] = hashlib.sha1(state).digest()
+            conversations[tuple(json.loads(key))] = pickle.loads(state)
+        return conversations
+
+    def get_subscriptions(self, name: str):
+        """Returns {key: set of chat ids} for the subscriptions saved under name."""
+        with self._lock:
+            rows = self._conn.execute('SELECT key, chat_id FROM subscriptions WHERE name = ?', (name,)).fetchall()
+            for key, chat_id in rows:
+                self._digests[('subscriptions', (name, key, chat_id))] = SUBSCRIBED
+        subscriptions = dict()
+        for key, chat_id in rows:
+            subscriptions.setdefault(key, set()).add(chat_id)
+        return subscriptions
+
+    def update_subscription(self, name: str, key: str, chat_id: int, subscribed: bool):
+        """Queues saving or deleting a single subscription."""
+        self._mark(('subscriptions', (name, key, chat_id)), b'' if subscribed else None)
+
+    def update_conversation(self, name: str, key, new_state):
+        # A state still being computed by a run_async or coroutine callback is saved as the
+        # state it will replace, and saved again once it resolves
+        while isinstance(new_state, tuple) and len(new_state) == 2 and isinstance(new_state[1], Promise):
+            new_state = new_state[0]
+        row_key = ('conversations', (name, json.dumps(list(key))))
+        self._mark(row_key, None if new_state is None else self._dumps(new_state, f'conversation {name}'))
+
+    def update_chat_data(self, chat_id: int, data):
+        self._mark(('chat_data', chat_id), self._dumps(data, f'chat {chat_id}'))
+
+    def update_user_data(self, user_id: int, data):
+        self._mark(('user_data', user_id), self._dumps(data, f'user {user_id}'))
+
+    def update_bot_data(self, data):
+        self._mark(('bot_data', 0), self._dumps(data, 'bot'))
+
+    def insert_bot(self, obj):
+        # Lazily loaded mappings must not be copied; their entries get the bot as they load
+        if isinstance(obj, _LazyData):
+            return obj
+        return super().insert_bot(obj)
+
+    def start(self):
+        """Starts writing changed rows every flush_interval seconds. Safe to call more than once."""
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._stopped.clear()
+            self._flusher = threading.Thread(target=self._flush_periodically, name='persistence', daemon=True)
+            self._flusher.start()
+
+    def flush(self):
+        """Writes every changed row in one transaction. Called by the Updater when stopping."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, dict()
+            if not dirty:
+                return
+            with self._conn:
+                for (table, key), data in dirty.items():
+                    if table == 'conversations':
+                        name, conversation_key = key
+                        if data is None:
+                            self._conn.execute('DELETE FROM conversations WHERE name = ? AND key = ?', (name, conversation_key))
+                        else:
+                            self._conn.execute(
+                                'INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)',
+                                (name, conversation_key, data),
+                            )
+                    elif table == 'subscriptions':
+                        if data is None:
+                            self._conn.execute('DELETE FROM subscriptions WHERE name = ? AND key = ? AND chat_id = ?', key)
+                        else:
+                            self._conn.execute('INSERT OR IGNORE INTO subscriptions (name, key, chat_id) VALUES (?, ?, ?)', key)
+                    else:
+                        self._conn.execute(f'INSERT OR REPLACE INTO {table} (id, data) VALUES (?, ?)', (key, data))
+        logger.debug(f'Persisted {len(dirty)} changed rows')
+
+    def stop(self):
+        """Stops the periodic flushes and writes what is left."""
+        self._stopped.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception(e)
+
+    def _load(self, table: str, key: int):
+        """Reads and unpickles one row, or returns an empty dict."""
+        with self._lock:
+            row = self._conn.execute(f'SELECT data FROM {table} WHERE id = ?', (key,)).fetchone()
+        if row is None:
+            return dict()
+        self._digests[(table, key)] = hashlib.sha1(row[0]).digest()
+        return super().insert_bot(pickle.loads(row[0]))
+
+    def _mark(self, row_key, data):
+        """Queues a row for the next flush unless it matches the row already stored or queued."""
+        digest = None if data is None else hashlib.sha1(data).digest()
+        with self._lock:
+            if self._digests.get(row_key) == digest:
+                return
+            self._digests[row_key] = digest
+            self._dirty[row_key] = data
+
+    @staticmethod
+    def _dumps(data, owner: str):
+        """Pickles data, leaving out any top level values that cannot be pickled."""
+        try:
+            return pickle.dumps(data)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            if not isinstance(data, dict):
+                raise
+
+        picklable = dict()
+        for key, value in data.items():
+            try:
+                pickle.dumps(value)
+            except (pickle.PicklingError, AttributeError, TypeError) as e:
+                logger.debug(f'Not persisting {key!r} of {owner}: {e}')
+                continue
+            picklable[key] = value
+        return pickle.dumps(picklable)
+
+
+class IncrementalDispatcher(Dispatcher):
+    """A Dispatcher whose saves without an update only cover the chats and users used since the last one.
+
+    PTB saves after every job, and without an update it pickles every chat and user loaded since
+    the restart. Handlers and jobs reach chat and user data through `chat_data[id]`, which
+    SQLitePersistence's mappings remember, so only those entries can have changed.
+    """
+
+    def update_persistence(self, update=None):
+        lazy = isinstance(self.chat_data, _LazyData) and isinstance(self.user_data, _LazyData)
+        if isinstance(update, Update) or not lazy or self.persistence is None:
+            return super().update_persistence(update)
+
+        with self._update_persistence_lock:
+            if self.persistence.store_bot_data:
+                self._save(self.persistence.update_bot_data, self.bot_data)
+            if self.persistence.store_chat_data:
+                for chat_id in self.chat_data.take_touched():
+                    if chat_id in self.chat_data:
+                        self._save(self.persistence.update_chat_data, chat_id, dict.get(self.chat_data, chat_id))
+            if self.persistence.store_user_data:
+                for user_id in self.user_data.take_touched():
+                    if user_id in self.user_data:
+                        self._save(self.persistence.update_user_data, user_id, dict.get(self.user_data, user_id))
+
+    def _save(self, update_data, *args):
+        try:
+            update_data(*args)
+        except Exception as e:
+            try:
+                self.dispatch_error(None, e)
+            except Exception:
+                logger.exception('Saving data raised an error, and so did the error handler')
+
+
+def incremental_updater(token: str, persistence: BasePersistence = None, workers: int = 4, connections: int = 0,
+                        dispatcher_class=IncrementalDispatcher, **kwargs):
+    """Builds an Updater around dispatcher_class(**kwargs), an IncrementalDispatcher by default.
+
+    The bot's connection pool has room for the run_async workers, `connections` more threads
+    calling the bot, and a few for polling and jobs.
+    """
+    bot = Bot(token, request=Request(con_pool_size=workers + connections + 4))
+    job_queue = JobQueue()
+    dispatcher = dispatcher_class(
+        bot,
+        Queue(),
+        workers=workers,
+        job_queue=job_queue,
+        persistence=persistence,
+        **kwargs,
+    )
+    job_queue.set_dispatcher(dispatcher)
+    return Updater(dispatcher=dispatcher, workers=None)    # workers must be left to the dispatcher
@@ -0,0 +1,140 @@
+"""A dispatcher that processes different chats in parallel while keeping each chat in order.
+
+PTB 13's dispatcher handles one update at a time, and `run_async` handlers lose the ordering
+that ConversationHandler needs for /claims and /supper. `ShardedDispatcher` instead hashes
+each update by chat onto one of N worker threads, each with its own queue, so a chat's updates
+are always handled one after another while other chats carry on in the other shards.
+"""
+from queue import Queue
+import logging
+import threading
+import time
+
+from telegram import Bot, Update
+from telegram.ext import BasePersistence, CallbackContext
+
+from cinnabot.persistence import IncrementalDispatcher, incremental_updater
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _Shard:
+    """One worker thread with its queue of (enqueued at, update) and wait time counters."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.queue = Queue()
+        self.thread = None
+        self.processed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def stats(self):
+        return {
+            'shard': self.index,
+            'depth': self.queue.qsize(),
+            'processed': self.processed,
+            'mean_wait': self.total_wait / self.processed if self.processed else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+
+class ShardedDispatcher(IncrementalDispatcher):
+    """Dispatches updates on `shards` worker threads, picking the thread by chat id.
+
+    Updates without a chat (such as inline queries) are sharded by user instead. Errors and
+    other non-update objects are handled on the dispatcher thread as usual.
+    """
+
+    def __init__(self, bot: Bot, update_queue: Queue, shards: int = 4, **kwargs):
+        super().__init__(bot, update_queue, **kwargs)
+        self._shards = [_Shard(i) for i in range(shards)]
+        self._shards_running = False
+
+    def start(self, ready: threading.Event = None):
+        """Starts the shard workers, then processes the update queue until stopped."""
+        # A second set of workers would take updates from the same queues, out of order
+        if self._shards_running or self.running:
+            logger.warning('already running')
+            if ready is not None:
+                ready.set()
+            return
+
+        for shard in self._shards:
+            shard.thread = threading.Thread(target=self._work, args=(shard,), name=f'dispatcher-shard-{shard.index}', daemon=True)
+            shard.thread.start()
+        self._shards_running = True
+        super().start(ready)
+
+    def stop(self):
+        """Stops taking updates, then lets every shard finish its queue."""
+        super().stop()
+        self._shards_running = False
+        for shard in self._shards:
+            shard.queue.put(None)
+        for shard in self._shards:
+            if shard.thread is not None:
+                shard.thread.join()
+            shard.thread = None
+
+    def process_update(self, update):
+        """Queues an update on its chat's shard."""
+        if not isinstance(update, Update) or not self._shards_running:
+            return super().process_update(update)
+
+        if update.effective_chat is not None:
+            key = update.effective_chat.id
+        elif update.effective_user is not None:
+            key = update.effective_user.id
+        else:
+            key = update.update_id
+        self._shards[key % len(self._shards)].queue.put((time.monotonic(), update))
+
+    def stats(self):
+        """Returns queue depth, updates processed and seconds waited in the queue per shard."""
+        return [shard.stats() for shard in self._shards]
+
+    def log_stats(self, context: CallbackContext = None):
+        """Job callback logging the shard stats."""
+        for stats in self.stats():
+            logger.info(
+                f"Shard {stats['shard']}: {stats['depth']} queued, {stats['processed']} processed, "
+                f"waited {stats['mean_wait'] * 1000:.0f}ms on average and {stats['max_wait'] * 1000:.0f}ms at most"
+            )
+
+    def _work(self, shard: _Shard):
+        """Thread target of a shard, handling its updates in the order they arrived."""
+        while True:
+            item = shard.queue.get()
+            if item is None:
+                break
+            enqueued, update = item
+            wait = time.monotonic() - enqueued
+            shard.processed += 1
+            shard.total_wait += wait
+            shard.max_wait = max(shard.max_wait, wait)
+            try:
+                super().process_update(update)
+            except Exception as e:
+                logger.exception(e)
+
+
+def sharded_updater(token: str, shards: int, workers: int = 4, persistence: BasePersistence = None, connections: int = 0):
+    """Builds an Updater whose dispatcher processes chats on `shards` worker threads.
+
+    `connections` reserves room in the bot's connection pool for other threads calling the bot.
+    """
+    # Every shard may hold a connection as well
+    return incremental_updater(
+        token,
+        persistence,
+        workers=workers,
+        connections=shards + connections,
+        dispatcher_class=ShardedDispatcher,
+        shards=shards,
+    )
@@ -1,13 +1,33 @@
-from datetime import datetime, timedelta
+from bisect import bisect_left, bisect_right
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+import hashlib
+import heapq
+import io
+import itertools
 import logging
+import re
+import sys
+import tempfile
+import threading
+import time
 import pytz
 
 from google.cloud.firestore import Client
 from google.auth.credentials import AnonymousCredentials
-from telegram import Update, ParseMode
-from telegram.ext import CallbackContext
+from telegram import (
+    Update, ParseMode, InlineKeyboardButton, InlineKeyboardMarkup,
+    InlineQueryResultArticle, InputTextMessageContent,
+)
+from telegram.error import BadRequest
+from telegram.ext import CallbackContext, JobQueue
 
 from cinnabot import Command
+from cinnabot.aio import asynchronous, to_thread
+from cinnabot.broadcast import RateLimitedSender
+from cinnabot.heatmap import occupancy, render_heatmap
+from cinnabot.persistence import SQLitePersistence
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', 
@@ -18,6 +38,660 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+SGT = pytz.timezone('Asia/Singapore')
+
+
+class Event:
+    """A single booking, built once when it is read from firestore.
+
+    Start and end dates are converted to Singapore time up front and venue names are interned,
+    so rendering and filtering never touch timezones or duplicate strings.
+    """
+
+    __slots__ = ('id', 'name', 'venue', 'start', 'end')
+
+    def __init__(self, id: str, name: str, venue: str, start: datetime, end: datetime):
+        self.id = id
+        self.name = name
+        self.venue = sys.intern(venue)
+        self.start = start.astimezone(SGT)
+        self.end = end.astimezone(SGT)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Builds an event from a (possibly projected) firestore document snapshot."""
+        return cls(
+            snapshot.id,
+            snapshot.get('name'),
+            snapshot.get('venueName'),
+            snapshot.get('startDate'),
+            snapshot.get('endDate'),
+        )
+
+    def __repr__(self):
+        return f'Event({self.id!r}, {self.name!r}, {self.venue!r}, {self.start}, {self.end})'
+
+
+def days_covered(start_time: datetime, end_time: datetime):
+    """Returns the UTC days touched by [start_time, end_time] as sorted 'YYYY-MM-DD' strings.
+
+    This is the bucketing scheme stored in each event's `daysCovered` field.
+    """
+    day = start_time.astimezone(pytz.UTC).date()
+    last = end_time.astimezone(pytz.UTC).date()
+    days = list()
+    while day <= last:
+        days.append(day.isoformat())
+        day += timedelta(days=1)
+    return days
+
+
+def free_slots(events, start_time: datetime, end_time: datetime):
+    """Returns the gaps in [start_time, end_time] not covered by any event as (start, end) pairs.
+
+    Overlapping bookings are merged with a single sweep over the events sorted by start time.
+    """
+    gaps = list()
+    cursor = start_time
+    for event in sorted(events, key=lambda x: x.start):
+        if cursor >= end_time:
+            break
+        if event.start > cursor:
+            gaps.append((cursor, min(event.start, end_time)))
+        cursor = max(cursor, event.end)
+
+    if cursor < end_time:
+        gaps.append((cursor, end_time))
+
+    return gaps
+
+
+def _ics_text(value: str):
+    """Escapes a TEXT property value (RFC 5545 3.3.11)."""
+    return value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _ics_line(line: str):
+    """Encodes a content line, folded so no line exceeds 75 octets (RFC 5545 3.1)."""
+    data = line.encode('utf-8')
+    folded = list()
+    while len(data) > 75:
+        cut = 75 if not folded else 74
+        while cut and (data[cut] & 0xC0) == 0x80:   # never split a UTF-8 sequence
+            cut -= 1
+        folded.append(data[:cut])
+        data = data[cut:]
+    folded.append(data)
+    return b'\r\n '.join(folded) + b'\r\n'
+
+
+def write_ics(events, out, stamp: datetime = None):
+    """Writes events to a binary file as an iCalendar feed, one VEVENT at a time."""
+    def utc(time: datetime):
+        return time.astimezone(pytz.UTC).strftime('%Y%m%dT%H%M%SZ')
+
+    stamp = utc(stamp or pytz.UTC.localize(datetime.utcnow()))
+    out.write(b''.join(_ics_line(line) for line in [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//USC//Cinnabot//EN',
+        'CALSCALE:GREGORIAN',
+        'X-WR-CALNAME:Spaces',
+    ]))
+    for event in events:
+        out.write(b''.join(_ics_line(line) for line in [
+            'BEGIN:VEVENT',
+            f'UID:{event.id}@cinnabot',
+            f'DTSTAMP:{stamp}',
+            f'DTSTART:{utc(event.start)}',
+            f'DTEND:{utc(event.end)}',
+            f'SUMMARY:{_ics_text(event.name)}',
+            f'LOCATION:{_ics_text(event.venue)}',
+            'END:VEVENT',
+        ]))
+    out.write(_ics_line('END:VCALENDAR'))
+
+
+class _StartList:
+    """Event ids kept sorted by start date so that overlap queries can bisect into them.
+
+    Bookings longer than LONG_BOOKING are kept in a list of their own, which every query checks,
+    so a single long booking cannot widen the stretch of start dates every query has to scan.
+    """
+
+    __slots__ = ('starts', 'ids', 'max_duration', 'long_starts', 'long_ids')
+
+    LONG_BOOKING = timedelta(days=1)
+
+    def __init__(self):
+        self.starts = list()            # sorted start dates
+        self.ids = list()               # event ids, parallel to self.starts
+        self.max_duration = timedelta(0)
+        self.long_starts = list()       # the same for bookings longer than LONG_BOOKING
+        self.long_ids = list()
+
+    def __len__(self):
+        return len(self.ids) + len(self.long_ids)
+
+    def add(self, event: Event):
+        duration = event.end - event.start
+        if duration > self.LONG_BOOKING:
+            starts, ids = self.long_starts, self.long_ids
+        else:
+            starts, ids = self.starts, self.ids
+            # Never shrinks on removal, but is capped by LONG_BOOKING
+            self.max_duration = max(self.max_duration, duration)
+        i = bisect_right(starts, event.start)
+        starts.insert(i, event.start)
+        ids.insert(i, event.id)
+
+    def discard(self, event: Event):
+        if event.end - event.start > self.LONG_BOOKING:
+            starts, ids = self.long_starts, self.long_ids
+        else:
+            starts, ids = self.starts, self.ids
+        i = bisect_left(starts, event.start)
+        while ids[i] != event.id:
+            i += 1
+        del starts[i]
+        del ids[i]
+
+    def candidates(self, start_time: datetime, end_time: datetime):
+        """Returns ids of events starting within [start_time - longest event, end_time].
+
+        Long bookings only count towards the longest event of their own list, all of which are checked.
+        """
+        lo = bisect_left(self.starts, start_time - self.max_duration)
+        hi = bisect_right(self.starts, end_time)
+        ids = self.ids[lo:hi]
+        if self.long_ids:
+            ids += self.long_ids[:bisect_right(self.long_starts, end_time)]
+        return ids
+
+
+class EventIndex:
+    """Resident index of events, sorted by start date overall and per venue.
+
+    Overlap queries only bisect into the candidates whose start lies within
+    `[start_time - longest event, end_time]`, plus the few bookings longer than a day, instead of
+    scanning (or downloading) every event that has not ended. Venue queries do the same on that
+    venue's bookings alone.
+
+    The index is written to by the firestore listener thread and read by the dispatcher, so all
+    access goes through a lock.
+    """
+
+    def __init__(self):
+        self.ready = threading.Event()  # Set once the initial snapshot has been loaded
+        self._lock = threading.Lock()
+        self._events = dict()           # event id -> event
+        self._all = _StartList()
+        self._by_venue = dict()         # venue name -> _StartList
+
+    def __len__(self):
+        return len(self._events)
+
+    def upsert(self, event: Event):
+        """Adds an event to the index, replacing any previous version of the same document."""
+        with self._lock:
+            self._remove(event.id)
+            self._events[event.id] = event
+            self._all.add(event)
+            self._by_venue.setdefault(event.venue, _StartList()).add(event)
+
+    def remove(self, event_id: str):
+        """Drops an event from the index if present."""
+        with self._lock:
+            self._remove(event_id)
+
+    def get(self, event_id: str):
+        """Returns the indexed event with this id, or None."""
+        with self._lock:
+            return self._events.get(event_id)
+
+    def venues(self):
+        """Returns the names of all venues with indexed bookings."""
+        with self._lock:
+            return list(self._by_venue)
+
+    def between(self, start_time: datetime, end_time: datetime, venue: str = None):
+        """Returns events starting before end_time and ending after start_time, by start date.
+
+        If venue is given, only that venue's bookings are searched.
+        """
+        with self._lock:
+            bookings = self._all if venue is None else self._by_venue.get(venue, _StartList())
+            candidates = [self._events[event_id] for event_id in bookings.candidates(start_time, end_time)]
+        # Long bookings come after the others, and sorting two sorted runs only merges them
+        events = [event for event in candidates if event.end >= start_time]
+        if bookings.long_ids:
+            events.sort(key=lambda x: x.start)
+        return events
+
+    def _remove(self, event_id: str):
+        """Removes an event without locking. Callers must hold self._lock."""
+        event = self._events.pop(event_id, None)
+        if event is None:
+            return
+        self._all.discard(event)
+        venue_bookings = self._by_venue[event.venue]
+        venue_bookings.discard(event)
+        if not venue_bookings:
+            del self._by_venue[event.venue]
+
+
+class ActiveBookings:
+    """Tracks the bookings that are happening right now.
+
+    Every tracked booking has its next transition (its start, then its end) on a min-heap.
+    Reading the active set first pops the transitions that have come due, moving bookings in
+    and out of it, so a read costs O(active) plus the transitions since the last read.
+    Changed or removed bookings leave stale heap entries behind, which are skipped when popped.
+    """
+
+    START, END = 0, 1
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap = list()             # (time, sequence, event id, version, START/END)
+        self._events = dict()           # event id -> (version, event) for bookings yet to end
+        self._active = dict()           # event id -> event
+        self._sequence = itertools.count()
+
+    def upsert(self, event: Event):
+        """Starts tracking a booking, replacing any previous version of it."""
+        with self._lock:
+            version = next(self._sequence)
+            self._events[event.id] = (version, event)
+            self._active.pop(event.id, None)
+            heapq.heappush(self._heap, (event.start, version, event.id, version, self.START))
+
+    def remove(self, event_id: str):
+        """Stops tracking a booking."""
+        with self._lock:
+            self._events.pop(event_id, None)
+            self._active.pop(event_id, None)
+
+    def active(self, now: datetime):
+        """Returns the bookings with start <= now <= end."""
+        with self._lock:
+            self._advance(now)
+            return [event for event in self._active.values() if event.start <= now <= event.end]
+
+    def _advance(self, now: datetime):
+        """Applies every transition due by now. Callers must hold self._lock."""
+        while self._heap and self._heap[0][0] <= now:
+            _, _, event_id, version, transition = heapq.heappop(self._heap)
+            tracked = self._events.get(event_id)
+            if tracked is None or tracked[0] != version:
+                continue
+
+            event = tracked[1]
+            if transition == self.START and event.end >= now:
+                self._active[event_id] = event
+                # Bookings are still active at exactly their end time
+                end = event.end + timedelta(microseconds=1)
+                heapq.heappush(self._heap, (end, next(self._sequence), event_id, version, self.END))
+            else:
+                self._active.pop(event_id, None)
+                del self._events[event_id]
+
+
+class DailyAggregates:
+    """Booking counts and booked hours per SGT day and venue, kept current one change at a time.
+
+    A booking spanning several days counts once on every day it touches, with its hours split
+    between them, so summaries over any range only add up days instead of rescanning bookings.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = dict()           # event id -> event counted in the totals
+        self._days = dict()             # date -> {venue: [bookings, booked seconds]}
+
+    def upsert(self, event: Event):
+        """Counts a booking, replacing any previous version of it."""
+        with self._lock:
+            self._remove(event.id)
+            self._events[event.id] = event
+            for day, seconds in self._split(event):
+                totals = self._days.setdefault(day, dict()).setdefault(event.venue, [0, 0])
+                totals[0] += 1
+                totals[1] += seconds
+
+    def remove(self, event_id: str):
+        """Stops counting a booking."""
+        with self._lock:
+            self._remove(event_id)
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self._days.clear()
+
+    def between(self, first: date, last: date):
+        """Returns [(day, {venue: (bookings, booked hours)})] for days in [first, last] with bookings."""
+        days = list()
+        with self._lock:
+            day = first
+            while day <= last:
+                if day in self._days:
+                    venues = {venue: (count, seconds / 3600) for venue, (count, seconds) in self._days[day].items()}
+                    days.append((day, venues))
+                day += timedelta(days=1)
+        return days
+
+    def _remove(self, event_id: str):
+        """Callers must hold self._lock."""
+        event = self._events.pop(event_id, None)
+        if event is None:
+            return
+        for day, seconds in self._split(event):
+            venues = self._days[day]
+            totals = venues[event.venue]
+            totals[0] -= 1
+            totals[1] -= seconds
+            if totals[0] == 0:
+                del venues[event.venue]
+                if not venues:
+                    del self._days[day]
+
+    @staticmethod
+    def _split(event: Event):
+        """Yields (day, seconds booked that day) for every SGT day the booking touches."""
+        day = event.start.date()
+        while True:
+            day_start = SGT.localize(datetime(day.year, day.month, day.day))
+            day_end = day_start + timedelta(days=1)
+            yield day, max(0, (min(event.end, day_end) - max(event.start, day_start)).total_seconds())
+            if event.end <= day_end:
+                return
+            day += timedelta(days=1)
+
+
+class ResponseCache:
+    """Thread-safe LRU cache whose entries expire `ttl` seconds after they are stored."""
+
+    def __init__(self, maxsize: int = 128, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (expiry, value), least recently used first
+
+    def get(self, key):
+        """Returns the cached value for key, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expiry, value = entry
+            if expiry < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl: float = None):
+        """Stores a value, evicting the least recently used entry when full.
+
+        ttl overrides the cache's default lifetime for this entry.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """Drops a single entry."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drops every entry."""
+        with self._lock:
+            self._entries.clear()
+
+
+class EventSource(ABC):
+    """Interface for the backends Spaces reads bookings from.
+
+    Requirements
+    ------------
+    events_between(start_time, end_time, venue=None) -> list of Event
+        Events overlapping [start_time, end_time] (timezone aware), optionally for one venue.
+    venues() -> list of str
+        Names of venues with known bookings.
+    """
+
+    def __init__(self):
+        self._listeners = list()
+
+    def start(self):
+        """Starts syncing bookings in the background, for sources that do so."""
+        return
+
+    def stop(self):
+        """Stops syncing bookings."""
+        return
+
+    def synced_since(self):
+        """Returns the time after which every ending booking reaches the listeners, or None if none do."""
+        return None
+
+    def add_listener(self, callback):
+        """Registers `callback(changes, initial)` to be called whenever bookings change.
+
+        changes is a list of (old, new) event pairs, where old is None for new bookings and new is
+        None for cancelled ones. initial is True for the batch that seeds the source on start.
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, changes, initial=False):
+        """Passes changed bookings on to every listener."""
+        for callback in self._listeners:
+            try:
+                callback(changes, initial)
+            except Exception as e:
+                logger.exception(e)
+
+    @abstractmethod
+    def events_between(self, start_time: datetime, end_time: datetime, venue: str = None):
+        """Returns events starting before end_time and ending after start_time."""
+        return
+
+    @abstractmethod
+    def venues(self):
+        """Returns the names of venues with known bookings."""
+        return
+
+
+class FirestoreEventSource(EventSource):
+    """Reads bookings from the firestore `events` collection.
+
+    Recent events are served from a resident EventIndex kept current by a snapshot listener.
+    Older windows, or requests made before the index is seeded, query firestore directly.
+    """
+
+    # How far back the resident index reaches. Older queries go straight to firestore.
+    INDEX_HISTORY = timedelta(days=31)
+
+    # How long a request waits for the index to be seeded before querying firestore directly.
+    INDEX_TIMEOUT = 10
+
+    # Strategies for querying firestore directly
+    RANGE_QUERY = 'range'       # endDate >= start, then filter startDate locally
+    DAY_BUCKET_QUERY = 'days'   # daysCovered array_contains_any days in the window
+
+    # Fields needed to filter and display an event. Direct queries fetch nothing else.
+    EVENT_FIELDS = ['name', 'venueName', 'startDate', 'endDate']
+
+    # Firestore caps the number of values in a single array_contains_any filter
+    MAX_DISJUNCTIONS = 10
+
+    # Document where scripts/backfill_days_covered.py records when its last run started, and how
+    # many seconds that time is cached for
+    BACKFILL_MARKER = ('cinnabot', 'daysCovered')
+    BACKFILL_MARKER_TTL = 10 * 60
+
+    def __init__(self, database: Client, use_index: bool = True, query_strategy: str = RANGE_QUERY):
+        super().__init__()
+        if query_strategy not in (self.RANGE_QUERY, self.DAY_BUCKET_QUERY):
+            raise ValueError(f'Unknown query strategy {query_strategy!r}')
+        self.db = database
+        self.use_index = use_index
+        self.query_strategy = query_strategy
+        self.index = EventIndex()
+        self._index_horizon = None
+        self._index_watch = None
+        self._index_lock = threading.Lock()
+        self._backfilled = None         # (monotonic time read, time of the last backfill or None)
+
+    def start(self):
+        """Seeds the event index and keeps it current with a firestore snapshot listener.
+
+        Only events ending after `INDEX_HISTORY` ago are watched. Safe to call more than once,
+        and does nothing if the index is disabled.
+        """
+        if not self.use_index:
+            return
+        with self._index_lock:
+            if self._index_watch is not None:
+                return
+            horizon = pytz.UTC.localize(datetime.utcnow() - self.INDEX_HISTORY)
+            self._index_horizon = horizon
+            self._index_watch = self.db.collection('events') \
+                .where('endDate', '>=', horizon) \
+                .on_snapshot(self._on_snapshot)
+            logger.info(f'Watching events ending after {horizon}')
+
+    def stop(self):
+        """Unsubscribes the snapshot listener. The index is rebuilt on the next start."""
+        with self._index_lock:
+            if self._index_watch is not None:
+                self._index_watch.unsubscribe()
+            self._index_watch = None
+            self._index_horizon = None
+            self.index = EventIndex()
+
+    def synced_since(self):
+        """Returns the horizon of the snapshot listener once the index is seeded, or None."""
+        return self._index_horizon if self.index.ready.is_set() else None
+
+    def _on_snapshot(self, documents, changes, read_time):
+        """Applies document changes pushed by firestore to the event index."""
+        index = self.index
+        event_changes = list()
+        for change in changes:
+            old = index.get(change.document.id)
+            if change.type.name == 'REMOVED':
+                index.remove(change.document.id)
+                event_changes.append((old or Event.from_snapshot(change.document), None))
+            else:
+                new = Event.from_snapshot(change.document)
+                index.upsert(new)
+                event_changes.append((old, new))
+
+        initial = not index.ready.is_set()
+        if event_changes or initial:
+            self._notify(event_changes, initial)
+
+        if initial:
+            logger.info(f'Event index seeded with {len(index)} events')
+            index.ready.set()
+
+    def events_between(self, start_time: datetime, end_time: datetime, venue: str = None):
+        """Returns events overlapping [start_time, end_time], from the index where possible."""
+        if self.use_index:
+            self.start()
+            if start_time < self._index_horizon:
+                logger.info(f'{start_time} is older than the event index, querying firestore')
+            elif self.index.ready.wait(self.INDEX_TIMEOUT):
+                return self.index.between(start_time, end_time, venue)
+            else:
+                logger.warning('Event index is not ready yet, querying firestore')
+
+        events = self._query_events(start_time, end_time)
+        if venue is not None:
+            events = [event for event in events if event.venue == venue]
+        return events
+
+    def venues(self):
+        """Returns indexed venues, or the venues booked in the coming week without an index."""
+        if self.use_index:
+            self.start()
+            self.index.ready.wait(self.INDEX_TIMEOUT)
+            return self.index.venues()
+
+        now = pytz.UTC.localize(datetime.utcnow())
+        return list({event.venue for event in self._query_events(now, now + timedelta(days=7))})
+
+    def _query_events(self, start_time: datetime, end_time: datetime):
+        """Queries firestore directly for events overlapping [start_time, end_time].
+
+        Bookings made since the last backfill have no `daysCovered` yet, so the day buckets are
+        only used for windows ending before it, and anything later is queried by range.
+        """
+        if self.query_strategy == self.DAY_BUCKET_QUERY:
+            backfilled = self._backfilled_until()
+            if backfilled is not None and end_time <= backfilled:
+                return self._query_events_by_day(start_time, end_time)
+            logger.info(f'daysCovered is only complete before {backfilled}, querying by range')
+        return self._query_events_by_range(start_time, end_time)
+
+    def _backfilled_until(self):
+        """Returns when the last daysCovered backfill started, or None if it never ran."""
+        now = time.monotonic()
+        if self._backfilled is None or now - self._backfilled[0] > self.BACKFILL_MARKER_TTL:
+            collection, document = self.BACKFILL_MARKER
+            snapshot = self.db.collection(collection).document(document).get()
+            backfilled = (snapshot.to_dict() or dict()).get('backfilledAt') if snapshot.exists else None
+            self._backfilled = (now, backfilled)
+        return self._backfilled[1]
+
+    def _query_events_by_range(self, start_time: datetime, end_time: datetime):
+        """Queries events that have not ended by start_time and filters the rest locally.
+
+        Sadly, firebase doesn't let us perform two inequality queries on different fields
+        simultaneously, so we perform the less intensive query locally. Only the fields we
+        display are fetched, and documents are filtered as they stream in so that events
+        starting after end_time are never built into events.
+        """
+        # Query: event.endDate >= start_time
+        not_ended = self.db.collection('events') \
+            .where('endDate', '>=', start_time) \
+            .select(self.EVENT_FIELDS) \
+            .stream()
+
+        # Query: event.startDate <= end_time
+        return [Event.from_snapshot(event) for event in not_ended if event.get('startDate') <= end_time]
+
+    def _query_events_by_day(self, start_time: datetime, end_time: datetime):
+        """Queries events through their precomputed `daysCovered` buckets.
+
+        Only events covering a day in the window are read, so read volume scales with the window
+        instead of with the number of future events. Relies on every document overlapping the
+        window carrying `daysCovered`, see scripts/backfill_days_covered.py.
+        """
+        days = days_covered(start_time, end_time)
+        events = dict()
+        for i in range(0, len(days), self.MAX_DISJUNCTIONS):
+            matches = self.db.collection('events') \
+                .where('daysCovered', 'array_contains_any', days[i:i + self.MAX_DISJUNCTIONS]) \
+                .select(self.EVENT_FIELDS) \
+                .stream()
+
+            # Buckets are whole days, so trim events outside the exact interval
+            for event in matches:
+                if event.id in events:
+                    continue
+                if event.get('startDate') <= end_time and event.get('endDate') >= start_time:
+                    events[event.id] = Event.from_snapshot(event)
+
+        return list(events.values())
+
+
 class Spaces(Command):
     command = 'spaces'
     help_text = 'Display bookings for venues!'
@@ -26,16 +700,175 @@ class Spaces(Command):
         "'/spaces' : to view all bookings for today\n"
         "'/spaces now' : to view bookings active at this very moment\n"
         "'/spaces week' : to view all bookings for this week\n"
+        "'/spaces venue <name>' : to view this week's bookings for one venue\n"
+        "'/spaces free <name> (dd/mm/yy (dd/mm/yy))' : to find when a venue is free\n"
+        "'/spaces subscribe <name>' : to be told when a venue's bookings change\n"
+        "'/spaces unsubscribe <name>' : to stop being told about a venue\n"
+        "'/spaces export dd/mm/yy dd/mm/yy' : to get bookings in a range of dates as a calendar file\n"
+        "'/spaces heatmap' : to see how busy every venue is over the coming week\n"
+        "'/spaces summary (dd/mm/yy (dd/mm/yy))' : to count bookings and booked hours per day and venue\n"
         "'/spaces dd/mm/yy' : to view all bookings on a specific day\n"
         "'/spaces dd/mm/yy dd/mm/yy' : to view all bookings in a specific range of dates"
     )
 
 
-    def __init__(self, database: Client):
-        self.db = database
-        
-        
-    def callback(self, update: Update, context: CallbackContext):
+    # Telegram caps message text at 4096 characters
+    MAX_MESSAGE_LENGTH = 4096
+
+    # Pages of a /spaces message hold at most this many bookings, and are cut short before their
+    # bookings outgrow PAGE_LENGTH characters, which leaves room for the heading and command list
+    PAGE_SIZE = 25
+    PAGE_LENGTH = MAX_MESSAGE_LENGTH - 512
+
+    # Callback data of the inline page buttons
+    PAGE_PATTERN = '^spaces:'
+
+    # Pre-rendered views stay cached until bookings change or the day rolls over
+    PRERENDER_TTL = 25 * 60 * 60
+
+    # Seconds to wait after a booking change before pre-rendering, so bursts of changes coalesce
+    PRERENDER_DELAY = 5
+
+    # Seconds to wait after a booking change before notifying subscribers, to batch bursts
+    NOTIFY_DELAY = 5
+
+    # Calendar exports bigger than this spill from memory to a temporary file
+    EXPORT_SPOOL_SIZE = 1024 * 1024
+
+    # Heatmaps are keyed by their bookings, so they only need to expire to free memory
+    HEATMAP_TTL = 7 * 24 * 60 * 60
+
+    # Inline queries like '@cinnabot spaces week', matched case insensitively
+    INLINE_PATTERN = r'(?i)^\s*(spaces\b)?\s*(today|week|now)?\s*$'
+
+    # Seconds telegram may reuse our inline answers for. Bookings active now go stale fastest
+    INLINE_CACHE_TIME = 300
+    INLINE_NOW_CACHE_TIME = 60
+
+    # Telegram shows at most 50 inline results per answer
+    INLINE_PAGE_SIZE = 50
+
+    def __init__(self, source: EventSource, cache_ttl: float = 60):
+        self.source = source
+        self.cache = ResponseCache(ttl=cache_ttl)
+        self.heatmaps = ResponseCache(maxsize=16, ttl=self.HEATMAP_TTL)    # digest -> PNG or file_id
+        self.job_queue = None
+        self.sender = None
+        self._prerender_pending = threading.Event()
+        self._notify_pending = threading.Event()
+        self._changes = list()          # booking changes not yet pushed to subscribers
+        self._changes_lock = threading.Lock()
+        self.subscriptions = dict()     # venue -> ids of chats subscribed to it
+        self.persistence = None
+        self._subscriptions_lock = threading.Lock()
+        self.active = ActiveBookings()
+        self.aggregates = DailyAggregates()
+        self._tracking = threading.Event()  # Set once the active bookings have been seeded
+        source.add_listener(self._on_events_changed)
+
+    def _on_events_changed(self, changes, initial):
+        """Drops rendered responses whenever the event source reports changed bookings.
+
+        Changes are fed to the active bookings tracker and the daily aggregates, and changes after the initial sync are
+        also queued up for subscribers of their venues.
+        """
+        if initial:
+            # A fresh sync repeats every booking, and may not mention ones deleted in between
+            self.aggregates.clear()
+        for old, new in changes:
+            if new is None:
+                self.active.remove(old.id)
+                self.aggregates.remove(old.id)
+            else:
+                self.active.upsert(new)
+                self.aggregates.upsert(new)
+        if initial:
+            self._tracking.set()
+
+        if changes:
+            self.invalidate_cache()
+            self._schedule_prerender()
+
+        if changes and not initial and self.job_queue is not None:
+            with self._changes_lock:
+                self._changes.extend(changes)
+            self._schedule_notify()
+
+    def schedule_jobs(self, job_queue: JobQueue):
+        """Pre-renders /spaces and /spaces week now, at midnight SGT, and after bookings change."""
+        self.job_queue = job_queue
+        midnight = SGT.localize(self._today()).astimezone(pytz.UTC).timetz()
+        job_queue.run_daily(self.prerender, midnight, name='spaces-prerender-daily')
+        self._schedule_prerender(delay=0)
+
+        # Pushes booking changes to subscribers within telegram's rate limits
+        self.sender = RateLimitedSender()
+        self.sender.start(job_queue)
+
+    def restore_subscriptions(self, persistence: SQLitePersistence):
+        """Loads the saved subscriptions, and saves every change to them from now on."""
+        with self._subscriptions_lock:
+            self.subscriptions = persistence.get_subscriptions(self.command)
+            self.persistence = persistence
+        logger.info(f'Restored subscriptions to {len(self.subscriptions)} venues')
+
+    def prerender(self, context: CallbackContext = None):
+        """Job callback that renders today's and this week's bookings into the cache."""
+        self._prerender_pending.clear()
+        today = self._today().date().isoformat()
+        for view in [('today', today), ('week', today)]:
+            self.cache.put((*view, 0), self._render_view(view, 0), ttl=self.PRERENDER_TTL)
+        for kind in ['today', 'week']:
+            self.cache.put(('inline', kind, today), self._inline_results(kind), ttl=self.PRERENDER_TTL)
+        logger.info(f'Pre-rendered /spaces views for {today}')
+
+    def _schedule_prerender(self, delay: float = None):
+        """Queues a single pre-render job unless one is already pending."""
+        if self.job_queue is None or self._prerender_pending.is_set():
+            return
+        self._prerender_pending.set()
+        delay = self.PRERENDER_DELAY if delay is None else delay
+        self.job_queue.run_once(self.prerender, delay, name='spaces-prerender')
+
+    def notify_subscribers(self, context: CallbackContext):
+        """Job callback that pushes queued booking changes to chats subscribed to their venues."""
+        self._notify_pending.clear()
+        with self._changes_lock:
+            changes, self._changes = self._changes, list()
+
+        now = pytz.UTC.localize(datetime.utcnow())
+        updates = dict()    # chat id -> formatted changes
+        for old, new in changes:
+            # Nobody needs to hear about past bookings or edits to fields we don't show
+            if (new or old).end < now:
+                continue
+            if old is not None and new is not None and self._same_booking(old, new):
+                continue
+
+            venues = {event.venue for event in (old, new) if event is not None}
+            with self._subscriptions_lock:
+                chats = {chat_id for venue in venues for chat_id in self.subscriptions.get(venue, ())}
+            text = self._format_change(old, new)
+            for chat_id in chats:
+                updates.setdefault(chat_id, list()).append(text)
+
+        for chat_id, texts in updates.items():
+            self.sender.send(chat_id, '\n\n'.join(['🤖: Booking updates for your venues!', *texts]))
+        if updates:
+            logger.info(f'Queued booking updates for {len(updates)} chats')
+
+    def _schedule_notify(self):
+        """Queues a single notification job unless one is already pending."""
+        if self._notify_pending.is_set():
+            return
+        self._notify_pending.set()
+        self.job_queue.run_once(self.notify_subscribers, self.NOTIFY_DELAY, name='spaces-notify')
+
+    async def callback(self, update: Update, context: CallbackContext):
+        """Runs the sub-handler off the event loop, since most of them read bookings and all reply"""
+        await to_thread(self.dispatch, update, context)
+
+    def dispatch(self, update: Update, context: CallbackContext):
         """Delegates behaviour to sub-handlers depending on input format"""
 
        
@@ -50,6 +883,34 @@ class Spaces(Command):
         # /spaces week
         elif context.args[0].lower() == 'week':
             self.spaces_week(update, context)
+
+        # /spaces venue <name>
+        elif context.args[0].lower() == 'venue':
+            self.spaces_venue(update, context)
+
+        # /spaces free <name> (dd/mm(/yy) (dd/mm(/yy)))
+        elif context.args[0].lower() == 'free':
+            self.spaces_free(update, context)
+
+        # /spaces subscribe <name>
+        elif context.args[0].lower() == 'subscribe':
+            self.spaces_subscribe(update, context)
+
+        # /spaces unsubscribe <name>
+        elif context.args[0].lower() == 'unsubscribe':
+            self.spaces_unsubscribe(update, context)
+
+        # /spaces export dd/mm(/yy) dd/mm(/yy)
+        elif context.args[0].lower() == 'export':
+            self.spaces_export(update, context)
+
+        # /spaces heatmap
+        elif context.args[0].lower() == 'heatmap':
+            self.spaces_heatmap(update, context)
+
+        # /spaces summary (dd/mm(/yy) (dd/mm(/yy)))
+        elif context.args[0].lower() == 'summary':
+            self.spaces_summary(update, context)
         
         # /spaces dd/mm(/yy)
         elif len(context.args) == 1:
@@ -61,30 +922,13 @@ class Spaces(Command):
 
     def spaces(self, update: Update, context: CallbackContext):
         """/spaces"""
-        now = datetime.now()
-        today = datetime(now.year, now.month, now.day) # reset time to midnight
-        tomorrow = today + timedelta(days=1)
-        
-        events = self._events_between(today, tomorrow)
-        text = '\n'.join([
-            f'*Displaying bookings for today:*',
-            '',
-            self._format_events(events),
-            '',
-            f'*Book a Venue*: \n'
-            'https://nususc.com/createevent \n'
-            '\n'
-            '',
+        today = self._today()
 
-        ])
-        text += "*More commands:*\n" + "'/spaces' : bookings for today\n" + "'/spaces now' : bookings active now\n" + "'/spaces week' : bookings for the week\n" + "'/spaces dd/mm/yy' : for a specific day\n" + "'/spaces dd/mm/yy dd/mm/yy' : for a period"
-        update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+        self._reply_view(update, ('today', today.date().isoformat()))
 
     def spaces_now(self, update: Update, context: CallbackContext):
         """/spaces now"""
-        now = datetime.now()
-
-        events = self._events_between(now, now)        
+        events = self._events_now()
         text = '\n'.join([
             f'Displaying ongoing bookings',
             '',
@@ -96,20 +940,111 @@ class Spaces(Command):
 
     def spaces_week(self, update: Update, context: CallbackContext):
         """/spaces week"""
-        now = datetime.now()
-        today = datetime(now.year, now.month, now.day) # reset time to midnight
-        week_later = today + timedelta(days=7)
+        today = self._today()
 
-        events = self._events_between(today, week_later)
-        text = '\n'.join([
-            f'Displaying bookings up to a week from today',
-            '',
-            self._format_events(events),
-            '',
-        ])
-        text += "More commands:\n" + "'/spaces' : bookings for today\n" + "'/spaces now' : bookings active now\n" + "'/spaces week' : bookings for the week\n" + "'/spaces dd/mm/yy' : for a specific day\n" + "'/spaces dd/mm/yy dd/mm/yy' : for a period"
+        self._reply_view(update, ('week', today.date().isoformat()))
+
+    def spaces_venue(self, update: Update, context: CallbackContext):
+        """/spaces venue <name>"""
+        query = ' '.join(context.args[1:])
+        if not query:
+            update.message.reply_text("Which venue? Try '/spaces venue <name>' :)")
+            return
+
+        venue = self._resolve_venue(update, query)
+        if venue is None:
+            return
+
+        today = self._today()
+
+        self._reply_view(update, ('venue', self._venue_key(venue), today.date().isoformat()))
+
+    def spaces_free(self, update: Update, context: CallbackContext):
+        """/spaces free <name> (dd/mm(/yy) (dd/mm(/yy)))"""
+        query, dates = self._split_venue_and_dates(context.args[1:])
+        if not query:
+            update.message.reply_text("Which venue? Try '/spaces free <name> dd/mm/yy' :)")
+            return
+
+        try:
+            dates = [self._format_day_string(day_str) for day_str in dates]
+        except (ValueError, TypeError) as e:
+            logger.error(e)
+            update.message.reply_text("Sorry that's an invalid date! Try dd/mm/yy instead :)")
+            return
+
+        venue = self._resolve_venue(update, query)
+        if venue is None:
+            return
+
+        # Same windows as /spaces, /spaces dd/mm/yy and /spaces dd/mm/yy dd/mm/yy
+        if not dates:
+            start_date = self._today()
+            end_date = start_date + timedelta(days=1)
+        elif len(dates) == 1:
+            start_date = dates[0]
+            end_date = start_date + timedelta(days=1)
+        else:
+            start_date, end_date = dates
+
+        key = ('free', venue, start_date.date(), end_date.date())
+        text = self._cached(key, self._render_free, venue, start_date, end_date)
         update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
 
+    def spaces_subscribe(self, update: Update, context: CallbackContext):
+        """/spaces subscribe <name>"""
+        query = ' '.join(context.args[1:])
+        chat_id = update.message.chat_id
+
+        # List this chat's subscriptions if no venue is given
+        if not query:
+            with self._subscriptions_lock:
+                venues = sorted(venue for venue, chats in self.subscriptions.items() if chat_id in chats)
+            if venues:
+                text = '\n'.join(["You're subscribed to:", *venues])
+            else:
+                text = "You aren't subscribed to any venues! Try '/spaces subscribe <name>' :)"
+            update.message.reply_text(text)
+            return
+
+        venue = self._resolve_venue(update, query)
+        if venue is None:
+            return
+
+        with self._subscriptions_lock:
+            self.subscriptions.setdefault(venue, set()).add(chat_id)
+            if self.persistence is not None:
+                self.persistence.update_subscription(self.command, venue, chat_id, True)
+        update.message.reply_text(
+            f"I'll let you know when bookings for {venue} are made, changed or cancelled! "
+            f"(use '/spaces unsubscribe {venue}' to stop)"
+        )
+
+    def spaces_unsubscribe(self, update: Update, context: CallbackContext):
+        """/spaces unsubscribe <name>"""
+        query = ' '.join(context.args[1:]).strip().lower()
+        chat_id = update.message.chat_id
+
+        # Match against this chat's subscriptions, the venue may have no bookings left
+        with self._subscriptions_lock:
+            venues = [venue for venue, chats in self.subscriptions.items() if chat_id in chats]
+            exact = [venue for venue in venues if venue.lower() == query]
+            venues = exact or [venue for venue in venues if query in venue.lower()]
+            if len(venues) == 1:
+                self.subscriptions[venues[0]].discard(chat_id)
+                if not self.subscriptions[venues[0]]:
+                    del self.subscriptions[venues[0]]
+                if self.persistence is not None:
+                    self.persistence.update_subscription(self.command, venues[0], chat_id, False)
+
+        if not venues:
+            update.message.reply_text("You aren't subscribed to that venue!")
+        elif len(venues) > 1:
+            text = '\n'.join([f'"{query}" matches more than one venue, which did you mean?', '', *sorted(venues)])
+            update.message.reply_text(text)
+        else:
+            update.message.reply_text(f"Okay! I'll stop telling you about {venues[0]}.")
+
     def spaces_day(self, update: Update, context: CallbackContext):
         """/spaces dd/mm(/yy)"""
         day_str = context.args[0]
@@ -121,16 +1056,7 @@ class Spaces(Command):
             update.message.reply_text("Sorry that's an invalid date! Try dd/mm/yy instead :)")
             return
         
-        day_later = day + timedelta(days=1)
-        events = self._events_between(day, day_later)
-        text = '\n'.join([
-            f'Displaying bookings for {day.date()}',
-            '',
-            self._format_events(events),
-            '',
-        ])
-        text += "More commands:\n" + "'/spaces' : bookings for today\n" + "'/spaces now' : bookings active now\n" + "'/spaces week' : bookings for the week\n" + "'/spaces dd/mm/yy' : for a specific day\n" + "'/spaces dd/mm/yy dd/mm/yy' : for a period"
-        update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+        self._reply_view(update, ('day', day.date().isoformat()))
 
     def spaces_date_range(self, update: Update, context: CallbackContext):
         """/spaces dd/mm(/yy) dd/mm(/yy)"""
@@ -144,47 +1070,471 @@ class Spaces(Command):
             update.message.reply_text("Sorry that's an invalid date! Try dd/mm/yy instead :)")
             return
         
+        self._reply_view(update, ('range', start_date.date().isoformat(), end_date.date().isoformat()))
+
+    def spaces_export(self, update: Update, context: CallbackContext):
+        """/spaces export dd/mm(/yy) dd/mm(/yy)"""
+        date_range = context.args[1:]
+        if len(date_range) != 2:
+            update.message.reply_text("Please tell me the dates to export, like '/spaces export dd/mm/yy dd/mm/yy' :)")
+            return
+
+        try:
+            start_date = self._format_day_string(date_range[0])
+            end_date = self._format_day_string(date_range[1])
+        except (ValueError, TypeError) as e:
+            logger.error(e)
+            update.message.reply_text("Sorry that's an invalid date! Try dd/mm/yy instead :)")
+            return
+
         events = self._events_between(start_date, end_date)
+        with tempfile.SpooledTemporaryFile(max_size=self.EXPORT_SPOOL_SIZE) as ics:
+            write_ics(events, ics)
+            ics.seek(0)
+            update.message.reply_document(
+                document=ics,
+                filename=f'spaces-{start_date.date()}-{end_date.date()}.ics',
+                caption=f'{len(events)} bookings between {start_date.date()} and {end_date.date()}',
+            )
+
+    def spaces_heatmap(self, update: Update, context: CallbackContext):
+        """/spaces heatmap"""
+        now = datetime.now(SGT)
+        start = SGT.localize(datetime(now.year, now.month, now.day))
+        end = start + timedelta(days=7)
+        events = self.source.events_between(start, end)
+        venues = sorted(set(self.source.venues()) | {event.venue for event in events})
+        if not venues:
+            update.message.reply_text('No events found!')
+            return
+
+        # Bookings only change the picture through these fields, so equal digests mean equal images
+        digest = hashlib.sha1(repr((
+            start.isoformat(),
+            venues,
+            sorted((event.id, event.venue, event.start.isoformat(), event.end.isoformat()) for event in events),
+        )).encode()).hexdigest()
+        caption = f'Venue occupancy from {start.date()} to {(end - timedelta(days=1)).date()}, darker is busier'
+
+        file_id = self.heatmaps.get(('file_id', digest))
+        if file_id is not None:
+            try:
+                update.message.reply_photo(photo=file_id, caption=caption)
+                return
+            except BadRequest as e:
+                logger.warning(f'Cached heatmap {file_id} rejected, sending it again: {e}')
+                self.heatmaps.invalidate(('file_id', digest))
+
+        png = self.heatmaps.get(('png', digest))
+        if png is None:
+            png = render_heatmap(occupancy(events, venues, start, 7 * 24), venues, start)
+            self.heatmaps.put(('png', digest), png)
+
+        message = update.message.reply_photo(photo=io.BytesIO(png), caption=caption)
+        if message and message.photo:
+            # Once telegram has the image it can be sent again by id without uploading it
+            self.heatmaps.put(('file_id', digest), message.photo[-1].file_id)
+            self.heatmaps.invalidate(('png', digest))
+
+    def spaces_summary(self, update: Update, context: CallbackContext):
+        """/spaces summary (dd/mm(/yy) (dd/mm(/yy)))"""
+        try:
+            dates = [self._format_day_string(day_str).date() for day_str in context.args[1:3]]
+        except (ValueError, TypeError) as e:
+            logger.error(e)
+            update.message.reply_text("Sorry that's an invalid date! Try dd/mm/yy instead :)")
+            return
+
+        # The coming week by default, otherwise one day or every day of a range
+        if not dates:
+            first = datetime.now(SGT).date()
+            last = first + timedelta(days=6)
+        elif len(dates) == 1:
+            first = last = dates[0]
+        else:
+            first, last = dates
+
+        text = self._cached(('summary', first.isoformat(), last.isoformat()), self._render_summary, first, last)
+        update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+
+    def _render_summary(self, first: date, last: date):
+        """Renders booking counts and hours per day and venue for the SGT days [first, last]."""
+        start = SGT.localize(datetime(first.year, first.month, first.day))
+        since = self.source.synced_since()
+        if self._tracking.is_set() and since is not None and since <= start:
+            days = self.aggregates.between(first, last)
+        else:
+            # Outside what the listener keeps current, so count this range from scratch
+            aggregates = DailyAggregates()
+            for event in self.source.events_between(start, start + timedelta(days=(last - first).days + 1)):
+                aggregates.upsert(event)
+            days = aggregates.between(first, last)
+
+        heading = f'*Bookings from {first} to {last}:*\n' if first != last else f'*Bookings on {first}:*\n'
+        if not days:
+            return heading + '\nNo events found!'
+
+        detailed, compact = list(), list()
+        for day, venues in days:
+            count = sum(bookings for bookings, _ in venues.values())
+            hours = sum(booked for _, booked in venues.values())
+            total = f"*{day.strftime('%a %d %b %y')}*: {count} booking{'s' if count != 1 else ''}, {hours:.1f}h"
+            compact.append(total)
+            detailed.append(total)
+            for venue in sorted(venues):
+                bookings, booked = venues[venue]
+                detailed.append(f'- {venue}: {bookings} ({booked:.1f}h)')
+
+        text = heading + '\n' + '\n'.join(detailed)
+        if len(text) > self.MAX_MESSAGE_LENGTH:
+            # Long ranges only list daily totals, and as many days of them as fit
+            while len(heading) + sum(len(line) + 1 for line in compact) + 20 > self.MAX_MESSAGE_LENGTH:
+                compact.pop()
+            text = heading + '\n' + '\n'.join(compact) + f'\n...until {last}'
+        return text
+
+    def inline_query(self, update: Update, context: CallbackContext):
+        """@cinnabot spaces (today|week|now)
+
+        Inline queries arrive on every keystroke, so answers only ever come from cached result
+        sets, which are pre-rendered for today and this week and rebuilt when bookings change.
+        """
+        query = update.inline_query
+        match = re.match(self.INLINE_PATTERN, query.query)
+        kind = (match and match.group(2) or 'today').lower()
+
+        if kind == 'now':
+            key = ('inline', kind, datetime.now().replace(second=0, microsecond=0).isoformat())
+            cache_time = self.INLINE_NOW_CACHE_TIME
+        else:
+            key = ('inline', kind, self._today().date().isoformat())
+            cache_time = self.INLINE_CACHE_TIME
+        results = self._cached(key, self._inline_results, kind)
+
+        offset = int(query.offset) if query.offset.isdigit() else 0
+        end = offset + self.INLINE_PAGE_SIZE
+        query.answer(
+            results[offset:end],
+            cache_time=cache_time,
+            next_offset=str(end) if end < len(results) else '',
+        )
+
+    def _inline_results(self, kind: str):
+        """Builds the inline query results for 'today', 'week' or 'now', one article per venue."""
+        if kind == 'now':
+            events = sorted(self._events_now(), key=lambda x: (x.venue, x.start))
+            heading = 'Ongoing bookings'
+        else:
+            today = self._today()
+            end = today + timedelta(days=1 if kind == 'today' else 7)
+            events = self._cached(('events', today, end, None), self._sorted_events_between, today, end)
+            heading = 'Bookings for today' if kind == 'today' else 'Bookings for this week'
+
+        if not events:
+            return [InlineQueryResultArticle(
+                id=f'{kind}:none',
+                title=f'{heading}: none',
+                input_message_content=InputTextMessageContent(f'*{heading}:*\n\nNo events found!', parse_mode=ParseMode.MARKDOWN),
+            )]
+
+        results = list()
+        for venue, venue_events in itertools.groupby(events, key=lambda x: x.venue):
+            venue_events = list(venue_events)
+            text = self._fit_message(f'*{heading}:*\n\n', venue_events)
+            results.append(InlineQueryResultArticle(
+                id=f'{kind}:{self._venue_key(venue)}',
+                title=venue,
+                description=f'{len(venue_events)} booking{"s" if len(venue_events) != 1 else ""}',
+                input_message_content=InputTextMessageContent(text, parse_mode=ParseMode.MARKDOWN),
+            ))
+        return results
+
+    def _fit_message(self, heading: str, events):
+        """Formats as many of the events as fit in one message, saying how many were left out."""
+        shown = len(events)
+        while True:
+            text = heading + self._format_events(events[:shown])
+            if shown < len(events):
+                text += f'\n...and {len(events) - shown} more'
+            if len(text) <= self.MAX_MESSAGE_LENGTH:
+                return text
+            shown = shown * 9 // 10
+
+    @asynchronous
+    async def page_callback(self, update: Update, context: CallbackContext):
+        """Handles the inline prev/next buttons, which may need to read and render bookings."""
+        await to_thread(self.flip_page, update, context)
+
+    def flip_page(self, update: Update, context: CallbackContext):
+        """Edits a /spaces message to show the page its pressed button points to."""
+        query = update.callback_query
+        _, *view, page = query.data.split(':')
+        view = tuple(view)
+
+        try:
+            page = int(page)
+            text, pages = self._cached((*view, page), self._render_view, view, page)
+        except (ValueError, KeyError, LookupError) as e:
+            logger.error(e)
+            query.answer('Sorry, this list has expired! Try /spaces again :)')
+            return
+
+        query.answer()
+        try:
+            query.edit_message_text(
+                text,
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=self._page_keyboard(view, min(page, pages - 1), pages),
+            )
+        except BadRequest as e:
+            # Telegram refuses edits that leave the message unchanged, e.g. tapping the page number
+            logger.info(e)
+
+    def invalidate_cache(self):
+        """Drops all rendered responses. Call whenever bookings change."""
+        self.cache.clear()
+
+    def _cached(self, key, render, *args):
+        """Returns the cached result for a normalized query window, rendering it on a miss."""
+        text = self.cache.get(key)
+        if text is None:
+            text = render(*args)
+            self.cache.put(key, text)
+        return text
+
+    def _reply_view(self, update: Update, view: tuple):
+        """Replies with the first page of a view, with buttons to flip through the rest."""
+        text, pages = self._cached((*view, 0), self._render_view, view, 0)
+        update.message.reply_text(
+            text,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=self._page_keyboard(view, 0, pages),
+        )
+
+    def _page_keyboard(self, view: tuple, page: int, pages: int):
+        """Returns prev/next buttons for a page of a view, or None if there is only one page.
+
+        The view and page are encoded in the callback data, which telegram caps at 64 bytes.
+        """
+        if pages <= 1:
+            return None
+
+        data = ':'.join(['spaces', *view, ''])
+        buttons = list()
+        if page > 0:
+            buttons.append(InlineKeyboardButton('« Prev', callback_data=f'{data}{page - 1}'))
+        buttons.append(InlineKeyboardButton(f'{page + 1}/{pages}', callback_data=f'{data}{page}'))
+        if page < pages - 1:
+            buttons.append(InlineKeyboardButton('Next »', callback_data=f'{data}{page + 1}'))
+        return InlineKeyboardMarkup([buttons])
+
+    def _render_view(self, view: tuple, page: int):
+        """Renders one page of a view, returning (text, number of pages).
+
+        Views are tuples of strings such as ('week', '2026-10-17') or ('range', start, end).
+        """
+        kind, *args = view
+        if kind == 'venue':
+            venue_key, day = args
+            return self._render_venue(self._venue_from_key(venue_key), datetime.fromisoformat(day), page)
+
+        dates = [datetime.fromisoformat(arg) for arg in args]
+        renders = {
+            'today': self._render_today,
+            'week': self._render_week,
+            'day': self._render_day,
+            'range': self._render_date_range,
+        }
+        return renders[kind](*dates, page=page)
+
+    def _page(self, start_date: datetime, end_date: datetime, page: int, venue: str = None):
+        """Returns (events on the page, page number, number of pages) for a window.
+
+        Events are sorted by venue then start time and split into pages once per window, so
+        every page after the first is a slice of a cached list and only the pages people open
+        get formatted.
+        """
+        window = (start_date, end_date, venue)
+        events = self._cached(('events', *window), self._sorted_events_between, start_date, end_date, venue)
+        starts = self._cached(('pages', *window), self._paginate, events)
+        pages = len(starts) - 1
+        page = min(max(page, 0), pages - 1)
+        return events[starts[page]:starts[page + 1]], page, pages
+
+    def _paginate(self, events):
+        """Returns the index each page of events starts at, followed by len(events).
+
+        A page ends after PAGE_SIZE events, or before the next event would take its formatted
+        text over PAGE_LENGTH characters.
+        """
+        starts = [0]
+        length = 0
+        venue = None
+        for i, event in enumerate(events):
+            size = self._formatted_length(event, event.venue != venue)
+            if i > starts[-1] and (i - starts[-1] >= self.PAGE_SIZE or length + size > self.PAGE_LENGTH):
+                starts.append(i)
+                length = 0
+                size = self._formatted_length(event, True)    # a new page repeats the venue heading
+            length += size
+            venue = event.venue
+        starts.append(len(events))
+        return starts
+
+    def _formatted_length(self, event: Event, new_venue: bool):
+        """Returns how many characters an event adds to _format_events, with its venue heading if new_venue."""
+        lines = self._event_lines(event)
+        if new_venue:
+            lines += self._venue_lines(event.venue) + ['']
+        return sum(len(line) + 1 for line in lines)
+
+    def _sorted_events_between(self, start_date: datetime, end_date: datetime, venue: str = None):
+        """Returns the events in a window, sorted by venue then start time."""
+        events = self._events_between(start_date, end_date, venue)
+        return sorted(events, key=lambda x: (x.venue, x.start))
+
+    def _render_today(self, today: datetime, page: int = 0):
+        """Renders a page of the /spaces message for the day starting at midnight `today`."""
+        tomorrow = today + timedelta(days=1)
+        
+        events, page, pages = self._page(today, tomorrow, page)
+        text = '\n'.join([
+            f'*Displaying bookings for today:*',
+            '',
+            self._format_events(events),
+            '',
+            f'*Book a Venue*: \n'
+            'https://nususc.com/createevent \n'
+            '\n'
+            '',
+
+        ])
+        text += "*More commands:*\n" + "'/spaces' : bookings for today\n" + "'/spaces now' : bookings active now\n" + "'/spaces week' : bookings for the week\n" + "'/spaces dd/mm/yy' : for a specific day\n" + "'/spaces dd/mm/yy dd/mm/yy' : for a period"
+        return text, pages
+
+    def _render_week(self, today: datetime, page: int = 0):
+        """Renders a page of the /spaces week message for the week starting at midnight `today`."""
+        week_later = today + timedelta(days=7)
+
+        events, page, pages = self._page(today, week_later, page)
+        text = '\n'.join([
+            f'Displaying bookings up to a week from today',
+            '',
+            self._format_events(events),
+            '',
+        ])
+        text += "More commands:\n" + "'/spaces' : bookings for today\n" + "'/spaces now' : bookings active now\n" + "'/spaces week' : bookings for the week\n" + "'/spaces dd/mm/yy' : for a specific day\n" + "'/spaces dd/mm/yy dd/mm/yy' : for a period"
+        return text, pages
+
+    def _render_venue(self, venue: str, today: datetime, page: int = 0):
+        """Renders a page of the /spaces venue message for the week starting at midnight `today`."""
+        week_later = today + timedelta(days=7)
+
+        events, page, pages = self._page(today, week_later, page, venue)
+        text = '\n'.join([
+            f'Displaying bookings for {venue} up to a week from today',
+            '',
+            self._format_events(events),
+            '',
+        ])
+        text += "More commands:\n" + "'/spaces' : bookings for today\n" + "'/spaces now' : bookings active now\n" + "'/spaces week' : bookings for the week\n" + "'/spaces dd/mm/yy' : for a specific day\n" + "'/spaces dd/mm/yy dd/mm/yy' : for a period"
+        return text, pages
+
+    def _render_free(self, venue: str, start_date: datetime, end_date: datetime):
+        """Renders the /spaces free message for a venue between two midnights."""
+        # refer to https://strftime.org/ for formatting details
+        date_format = '%I:%M%p, %a %d %b %y'
+
+        # Free slots are shown to the minute, so the window runs between Singapore midnights
+        start_time = SGT.localize(start_date)
+        end_time = SGT.localize(end_date)
+        events = self.source.events_between(start_time, end_time, venue)
+        gaps = free_slots(events, start_time, end_time)
+
+        lines = [f'*{venue}* is free:', '']
+        for gap_start, gap_end in gaps:
+            lines.extend([
+                f'- {gap_start.astimezone(SGT).strftime(date_format)} to',
+                f'  {gap_end.astimezone(SGT).strftime(date_format)}',
+            ])
+        if not gaps:
+            lines.append('Never, sorry! It is fully booked.')
+
+        text = '\n'.join([
+            f'Displaying free slots between {start_date.date()} and {end_date.date()}',
+            '',
+            *lines,
+            '',
+        ])
+        text += "More commands:\n" + "'/spaces' : bookings for today\n" + "'/spaces now' : bookings active now\n" + "'/spaces week' : bookings for the week\n" + "'/spaces dd/mm/yy' : for a specific day\n" + "'/spaces dd/mm/yy dd/mm/yy' : for a period"
+        return text
+
+    def _render_day(self, day: datetime, page: int = 0):
+        """Renders a page of the /spaces dd/mm/yy message for `day`."""
+        day_later = day + timedelta(days=1)
+        events, page, pages = self._page(day, day_later, page)
+        text = '\n'.join([
+            f'Displaying bookings for {day.date()}',
+            '',
+            self._format_events(events),
+            '',
+        ])
+        text += "More commands:\n" + "'/spaces' : bookings for today\n" + "'/spaces now' : bookings active now\n" + "'/spaces week' : bookings for the week\n" + "'/spaces dd/mm/yy' : for a specific day\n" + "'/spaces dd/mm/yy dd/mm/yy' : for a period"
+        return text, pages
+
+    def _render_date_range(self, start_date: datetime, end_date: datetime, page: int = 0):
+        """Renders a page of the /spaces dd/mm/yy dd/mm/yy message for [start_date, end_date]."""
+        events, page, pages = self._page(start_date, end_date, page)
         text = '\n'.join([
             f'Displaying bookings between {start_date.date()} and {end_date.date()}',
             '',
             self._format_events(events),
         ])
         text += "More commands:\n" + "'/spaces' : bookings for today\n" + "'/spaces now' : bookings active now\n" + "'/spaces week' : bookings for the week\n" + "'/spaces dd/mm/yy' : for a specific day\n" + "'/spaces dd/mm/yy dd/mm/yy' : for a period"
-        update.message.reply_text(text, parse_mode=ParseMode.MARKDOWN)
+        return text, pages
         
-    def _events_between(self, start_time: datetime, end_time: datetime):
+    def _events_now(self):
+        """Returns the bookings active right now."""
+        now = datetime.now(SGT).replace(tzinfo=None)
+
+        # The tracker is only fed by sources that sync, and only once they have
+        if self._tracking.is_set():
+            return self.active.active(SGT.localize(now))
+        return self._events_between(now, now)
+
+    def _events_between(self, start_time: datetime, end_time: datetime, venue: str = None):
         """gets a set of events (E) overlapping with some interval [start_time, end_time].
         
         E = {event : event.startDate <= end_time & event.endDate >= start_time}
-        
-        Sadly, firebase doesn't let us perform two inequality queries on different fields
-        simultaneously, so we perform the less intensive query locally.
+
+        Times are Singapore wall-clock times, so every view splits days at midnight SGT, like
+        /spaces summary and /spaces heatmap. If venue is given, only bookings for that venue are returned.
         """
         # Convert to datatype that plays well with firestore's timestamp
-        start_time = pytz.UTC.localize(start_time)
-        end_time = pytz.UTC.localize(end_time)
+        start_time = SGT.localize(start_time)
+        end_time = SGT.localize(end_time)
 
-        # Query: event.endDate >= start_time
-        not_ended = self.db.collection('events') \
-            .where('endDate', '>=', start_time) \
-            .get()
+        return self.source.events_between(start_time, end_time, venue)
 
-        # Query: event.startDate <= end_time
-        events = [event.to_dict() for event in not_ended]
-        events = [event for event in events if event.get('startDate') <= end_time]
-        
-        return events
+    def _match_venue(self, query: str):
+        """Returns the venue names matching a user's query, case insensitively.
+
+        An exact match wins, otherwise every venue containing the query is returned.
+        """
+        venues = self.source.venues()
+
+        query = query.strip().lower()
+        exact = [venue for venue in venues if venue.lower() == query]
+        if exact:
+            return exact
+        return sorted(venue for venue in venues if query in venue.lower())
     
     def _format_events(self, events):
         """Return format string of event details (name, venue, start date, end date)."""
-        # refer to https://strftime.org/ for formatting details
-        date_format = '%I:%M%p, %a %d %b %y'
-
         # Group events by venue
         events_by_venue = dict()
         for event in events:
-            venue = event['venueName']
+            venue = event.venue
             if venue not in events_by_venue:
                  events_by_venue[venue] = list()
             events_by_venue[venue].append(event)
@@ -192,21 +1542,9 @@ class Spaces(Command):
         # Build formatted message
         lines = list()
         for venue, venue_events in events_by_venue.items():
-            lines.extend([
-                '====================',
-                f'🌌*{venue}*',
-                '====================',
-            ])
-            for event in sorted(venue_events, key=lambda x: x['startDate']):
-                event_name = event['name']
-                start_date = event['startDate'].astimezone(pytz.timezone('Asia/Singapore'))
-                end_date = event['endDate'].astimezone(pytz.timezone('Asia/Singapore'))
-
-                lines.extend([
-                    f'*{event_name}*',
-                    f'- {start_date.strftime(date_format)} to',
-                    f'- {end_date.strftime(date_format)}',
-                ])
+            lines.extend(self._venue_lines(venue))
+            for event in sorted(venue_events, key=lambda x: x.start):
+                lines.extend(self._event_lines(event))
                 
                 # if start_date == end_date:
                 #     lines.append(f'*{event_name}*: {start_time} to {end_time}, {end_date}')
@@ -222,13 +1560,85 @@ class Spaces(Command):
 
         return text
 
+    def _venue_lines(self, venue: str):
+        """Returns the lines heading a venue's events in _format_events."""
+        return [
+            '====================',
+            f'🌌*{venue}*',
+            '====================',
+        ]
+
+    def _event_lines(self, event: Event):
+        """Returns the lines describing one event in _format_events."""
+        # refer to https://strftime.org/ for formatting details
+        date_format = '%I:%M%p, %a %d %b %y'
+        return [
+            f'*{event.name}*',
+            f'- {event.start.strftime(date_format)} to',
+            f'- {event.end.strftime(date_format)}',
+        ]
+
+    def _same_booking(self, old: Event, new: Event):
+        """Returns whether two versions of a booking look the same to users."""
+        return (old.name, old.venue, old.start, old.end) == (new.name, new.venue, new.start, new.end)
+
+    def _format_change(self, old: Event, new: Event):
+        """Return plain text describing a booking that was made, changed or cancelled."""
+        # refer to https://strftime.org/ for formatting details
+        date_format = '%I:%M%p, %a %d %b %y'
+
+        def describe(event):
+            return f'{event.name} @ {event.venue}\n{event.start.strftime(date_format)} to {event.end.strftime(date_format)}'
+
+        if old is None:
+            return f'New booking:\n{describe(new)}'
+        if new is None:
+            return f'Cancelled:\n{describe(old)}'
+        return f'Changed:\n{describe(old)}\nis now\n{describe(new)}'
+
+    def _venue_key(self, venue: str):
+        """Returns a short, stable key for a venue that fits in inline button callback data."""
+        return hashlib.sha1(venue.encode()).hexdigest()[:10]
+
+    def _venue_from_key(self, key: str):
+        """Returns the venue with this _venue_key. Raises LookupError if there is none."""
+        for venue in self.source.venues():
+            if self._venue_key(venue) == key:
+                return venue
+        raise LookupError(f'No venue with key {key}')
+
+    def _resolve_venue(self, update: Update, query: str):
+        """Returns the single venue matching query, or replies with the problem and returns None."""
+        venues = self._match_venue(query)
+        if not venues:
+            update.message.reply_text(f"Sorry, I couldn't find any bookings for a venue called {query}!")
+            return None
+        if len(venues) > 1:
+            text = '\n'.join([f'"{query}" matches more than one venue, which did you mean?', '', *venues])
+            update.message.reply_text(text)
+            return None
+        return venues[0]
+
+    def _today(self):
+        """Returns midnight at the start of today in Singapore, which is how every /spaces view is keyed."""
+        now = datetime.now(SGT)
+        return datetime(now.year, now.month, now.day) # reset time to midnight
+
+    def _split_venue_and_dates(self, args):
+        """Splits '<venue name> (dd/mm(/yy) (dd/mm(/yy)))' into the venue query and date strings."""
+        args = list(args)
+        dates = list()
+        while args and len(dates) < 2 and '/' in args[-1]:
+            dates.insert(0, args.pop())
+        return ' '.join(args), dates
+
     def _format_day_string(self, day_str):
         """Takes in string dd/mm(/yy) and returns datetime object. Returns ValuError otherwise."""
         date_fields = day_str.split('/')
 
         if len(date_fields) == 2:
             # dd/mm
-            day_str += '/' + str(datetime.now().year)       # Append year
+            day_str += '/' + str(datetime.now(SGT).year)    # Append year
             day = datetime.strptime(day_str, "%d/%m/%Y")    # Str to datetime
         elif len(date_fields) == 3:
             # dd/mm/yy
@@ -245,7 +1655,7 @@ if __name__ == "__main__":
 
     # Initialize a backend with a firestore client
     firestore = Client(project='usc-website-206715')
-    spaces = Spaces(database=firestore)
+    spaces = Spaces(source=FirestoreEventSource(firestore))
     
     # Test event querying (Actually this block can go in Spaces.spaces)
     now = datetime.now()
@@ -255,10 +1665,9 @@ if __name__ == "__main__":
     events = spaces._events_between(today, tomorrow)
 
     for event in events:
-        # Each "event" is a dictionary following the schema of documents in firestore
         print(80*'=')
-        print(event['name'])
+        print(event.name)
         print(80*'-')
-        print('- Venue:', event['venueName'])
-        print('- start:', event['startDate'])
-        print('- end  :', event['endDate'])
+        print('- Venue:', event.venue)
+        print('- start:', event.start)
+        print('- end  :', event.end)
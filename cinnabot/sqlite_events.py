@@ -0,0 +1,191 @@
+"""A local SQLite mirror of the firestore `events` collection for /spaces.
+
+The mirror is kept in sync incrementally by a firestore snapshot listener and answers interval
+queries from indexed local tables, so /spaces keeps working (with the last synced bookings)
+while firestore is slow or unreachable, and across restarts when the file is kept around.
+"""
+from datetime import datetime, timedelta
+import logging
+import sqlite3
+import threading
+
+import pytz
+from google.cloud.firestore import Client
+
+from cinnabot.spaces import Event, EventSource
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO,
+)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    venueName TEXT NOT NULL,
+    startDate REAL NOT NULL,
+    endDate REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_startDate ON events (startDate);
+CREATE INDEX IF NOT EXISTS events_endDate ON events (endDate);
+CREATE INDEX IF NOT EXISTS events_venueName ON events (venueName, startDate);
+CREATE TABLE IF NOT EXISTS sync (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+
+class SQLiteEventSource(EventSource):
+    """Serves bookings from a SQLite file mirroring firestore's `events` collection.
+
+    Dates are stored as UTC unix timestamps. Events ending after `SYNC_HISTORY` ago are synced
+    from a snapshot listener; older rows are kept so past windows can still be answered.
+    """
+
+    # How far back the snapshot listener syncs
+    SYNC_HISTORY = timedelta(days=31)
+
+    def __init__(self, database: Client, path: str = 'events.sqlite3'):
+        super().__init__()
+        self.db = database
+        self.path = path
+        self._lock = threading.Lock()          # guards the connection
+        self._watch_lock = threading.Lock()    # guards the listener
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self._max_duration = self._conn.execute(
+            'SELECT COALESCE(MAX(endDate - startDate), 0) FROM events'
+        ).fetchone()[0]
+        self._horizon = None
+        self._watch = None
+        self._seeded = False
+
+    def start(self):
+        """Subscribes to firestore changes. Safe to call more than once."""
+        with self._watch_lock:
+            if self._watch is not None:
+                return
+            self._horizon = pytz.UTC.localize(datetime.utcnow() - self.SYNC_HISTORY)
+            self._seeded = False
+            self._watch = self.db.collection('events') \
+                .where('endDate', '>=', self._horizon) \
+                .on_snapshot(self._on_snapshot)
+            logger.info(f'Mirroring events ending after {self._horizon} into {self.path}')
+
+    def stop(self):
+        """Unsubscribes from firestore. The local mirror stays readable."""
+        with self._watch_lock:
+            if self._watch is not None:
+                self._watch.unsubscribe()
+            self._watch = None
+
+    def synced_since(self):
+        """Returns the horizon of the snapshot listener once the mirror has synced, or None."""
+        return self._horizon if self._seeded else None
+
+    def last_synced(self):
+        """Returns when firestore last pushed changes to the mirror, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM sync WHERE key = 'read_time'").fetchone()
+        return row and row[0]
+
+    def events_between(self, start_time: datetime, end_time: datetime, venue: str = None):
+        """Returns mirrored events overlapping [start_time, end_time], ordered by start date."""
+        self.start()
+        start, end = start_time.timestamp(), end_time.timestamp()
+        query = '''
+            SELECT id, name, venueName, startDate, endDate FROM events
+            WHERE startDate BETWEEN ? AND ? AND endDate >= ?
+        '''
+        params = [start - self._max_duration, end, start]
+        if venue is not None:
+            query += ' AND venueName = ?'
+            params.append(venue)
+        query += ' ORDER BY startDate'
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [self._to_event(row) for row in rows]
+
+    def venues(self):
+        """Returns every venue in the mirror."""
+        self.start()
+        with self._lock:
+            rows = self._conn.execute('SELECT DISTINCT venueName FROM events').fetchall()
+        return [venue for venue, in rows]
+
+    def _on_snapshot(self, documents, changes, read_time):
+        """Writes document changes pushed by firestore to the mirror in one transaction."""
+        with self._lock:
+            initial = not self._seeded
+            event_changes = list()
+            with self._conn:
+                for change in changes:
+                    old = self._get(change.document.id)
+                    if change.type.name == 'REMOVED':
+                        self._conn.execute('DELETE FROM events WHERE id = ?', (change.document.id,))
+                        event_changes.append((old or Event.from_snapshot(change.document), None))
+                    else:
+                        new = Event.from_snapshot(change.document)
+                        self._put(new)
+                        event_changes.append((old, new))
+
+                # Deletions made while we were not listening never show up as changes
+                if initial:
+                    event_changes.extend(self._drop_missing(documents))
+
+                if read_time is not None:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO sync (key, value) VALUES ('read_time', ?)",
+                        (str(read_time),),
+                    )
+            self._seeded = True
+
+        if event_changes or initial:
+            self._notify(event_changes, initial)
+        if initial:
+            logger.info(f'Event mirror synced with {len(documents)} recent events')
+
+    def _drop_missing(self, documents):
+        """Deletes synced rows that are absent from a full snapshot. Callers must hold self._lock."""
+        present = {document.id for document in documents}
+        rows = self._conn.execute(
+            'SELECT id, name, venueName, startDate, endDate FROM events WHERE endDate >= ?',
+            (self._horizon.timestamp(),),
+        ).fetchall()
+        removed = [self._to_event(row) for row in rows if row[0] not in present]
+        self._conn.executemany('DELETE FROM events WHERE id = ?', [(event.id,) for event in removed])
+        return [(event, None) for event in removed]
+
+    def _get(self, event_id: str):
+        """Returns the mirrored event with this id, or None. Callers must hold self._lock."""
+        row = self._conn.execute(
+            'SELECT id, name, venueName, startDate, endDate FROM events WHERE id = ?',
+            (event_id,),
+        ).fetchone()
+        return row and self._to_event(row)
+
+    def _put(self, event: Event):
+        """Inserts or replaces an event. Callers must hold self._lock."""
+        start, end = event.start.timestamp(), event.end.timestamp()
+        self._conn.execute(
+            'INSERT OR REPLACE INTO events (id, name, venueName, startDate, endDate) VALUES (?, ?, ?, ?, ?)',
+            (event.id, event.name, event.venue, start, end),
+        )
+        self._max_duration = max(self._max_duration, end - start)
+
+    @staticmethod
+    def _to_event(row):
+        event_id, name, venue, start, end = row
+        return Event(
+            event_id,
+            name,
+            venue,
+            datetime.fromtimestamp(start, pytz.UTC),
+            datetime.fromtimestamp(end, pytz.UTC),
+        )
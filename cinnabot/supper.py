@@ -1,3 +1,4 @@
+from collections import deque
 import logging
 import random
 
@@ -30,6 +31,10 @@ STATES = range(2)
     END
 ) = STATES
 
+# Steps remembered for the back button, as (state, user input), with (None, None) for the entry
+HISTORY_SIZE = 16
+ENTRY = (None, None)
+
 class Reply:
     """Data class that handles telegram reply type according to arguments.
     This exists in part only to make maintaining the chatbot structure easier"""
@@ -80,20 +85,21 @@ class Supper(Conversation):
                 CommandHandler(self.command, self.entry),
             ],
             states = {
-                state: self.make_handlers(mapping)
+                state: self.make_handlers(state, mapping)
                 for state, mapping in self.DATA.items()
             },
             fallbacks = [
                 CommandHandler('cancel', self.cancel),
                 MessageHandler(Filters.text, self.error),
             ],
+            name = self.command,
+            persistent = True,
         )
 
     def entry(self, update: Update, context: CallbackContext):
         """Starts conversation after /supper"""
         logger.info('entry')
-        context.chat_data['history'] = list()
-        context.chat_data['history'].append(self.entry)
+        context.chat_data['supper_history'] = deque([ENTRY], maxlen=HISTORY_SIZE)
         name = update.message.from_user.first_name
         text = f'🤖: Hey {name}, what would you like to order? (/cancel to exit)'
         update.message.reply_text(
@@ -121,14 +127,22 @@ class Supper(Conversation):
         return ConversationHandler.END 
     
     def back(self, update: Update, context: CallbackContext):
-        """Delegates callback to the last recorded callback"""
-        last_callback = context.chat_data['history'].pop() # Undo wrong callback
-        last_callback = context.chat_data['history'][-1] # Replay last callback
-        next_state = last_callback(update, context) # Skip content messages
-        return next_state
-
-    def make_callback(self, user_input, replies):
-        """Constructs a callback"""
+        """Replays the step before the last one recorded in the chat's history"""
+        history = context.chat_data.get('supper_history')
+        if history:
+            history.pop() # Undo wrong callback
+
+        # Start over once the history runs out, e.g. after a restart or many steps back
+        if not history or history[-1] == ENTRY:
+            return self.entry(update, context)
+
+        # Replay the last step in full, which records it in the history again
+        state, user_input = history.pop()
+        callback = self.make_callback(state, user_input, self.DATA[state][user_input])
+        return callback(update, context)
+
+    def make_callback(self, state, user_input, replies):
+        """Constructs a callback for user_input in state"""
         def callback(update: Update, context: CallbackContext, replay=False):
             logger.info(f'{update.message.from_user.id}: "{user_input}"')
 
@@ -136,7 +150,8 @@ class Supper(Conversation):
             if replay:
                 selected_replies = replies[-1:]
             else:
-                context.chat_data['history'].append(callback)
+                history = context.chat_data.setdefault('supper_history', deque([ENTRY], maxlen=HISTORY_SIZE))
+                history.append((state, user_input))
                 selected_replies = replies
 
             # Send out replies and update the application state
@@ -149,14 +164,14 @@ class Supper(Conversation):
             return next_state
         return callback   
 
-    def make_handlers(self, mapping):
+    def make_handlers(self, state, mapping):
         """Builds a list of handlers from chatbot data"""
         handlers = [MessageHandler(Filters.regex('Back'), self.back)]
         for user_input, replies in mapping.items():
             pattern = '^' + user_input.replace('(', r'\(').replace(')', r'\)') + '$'
             handlers.append(MessageHandler(
                 Filters.regex(pattern), 
-                self.make_callback(user_input, replies),
+                self.make_callback(state, user_input, replies),
             ))
         return handlers
 
@@ -23,6 +23,7 @@ from telegram.ext import (
 )
 
 from cinnabot import Command, Conversation
+from cinnabot.assets import file_ids, resolve
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', 
@@ -59,18 +60,23 @@ class NUSMap(Conversation):
     }
 
     IMAGE_URLS = {
-        "chs": Path("cinnabot", "maps", "CHS Map.png"),
-        "computing": Path("cinnabot", "maps", "Computing Map.png"),
-        "law": Path("cinnabot", "maps", "Law Map.png"),
-        "business": Path("cinnabot", "maps", "Biz Map.png"),
-        "utown": Path("cinnabot", "maps", "UTown Map.png"),
-        "cde": Path("cinnabot", "maps", "CDE Map.png"),
+        "chs": resolve(Path("cinnabot", "maps", "CHS Map.png")),
+        "computing": resolve(Path("cinnabot", "maps", "Computing Map.png")),
+        "law": resolve(Path("cinnabot", "maps", "Law Map.png")),
+        "business": resolve(Path("cinnabot", "maps", "Biz Map.png")),
+        "utown": resolve(Path("cinnabot", "maps", "UTown Map.png")),
+        "cde": resolve(Path("cinnabot", "maps", "CDE Map.png")),
     }
 
     TAGS = [button for row in KEYBOARD for button in row]
 
     KEYBOARD_PATTERN = '^(' + '|'.join(TAGS) + ')$' # Regex to match all valid replies
 
+    @classmethod
+    def assets(cls):
+        """Returns (path, attachment type) for every map sent."""
+        return [(path, 'photo') for path in cls.IMAGE_URLS.values()]
+
     @property
     def handler(self):
         return ConversationHandler(
@@ -109,14 +115,19 @@ class NUSMap(Conversation):
         
         location = update.message.text.lower()
         name = update.message.from_user.first_name
-        with open(self.IMAGE_URLS[location], 'rb') as image:
-            text = '\n'.join([
-                f'🤖: Hey {name}, here is a map of your location. Hope you may find your way around!',
-                '',
-                'For more information, please visit',
-                self.NUSMODS_URLS[location],
-            ])
-            update.message.reply_photo(photo=image, caption=text, reply_markup=ReplyKeyboardRemove())
+        text = '\n'.join([
+            f'🤖: Hey {name}, here is a map of your location. Hope you may find your way around!',
+            '',
+            'For more information, please visit',
+            self.NUSMODS_URLS[location],
+        ])
+        file_ids.send(
+            self.IMAGE_URLS[location],
+            update.message.reply_photo,
+            'photo',
+            caption=text,
+            reply_markup=ReplyKeyboardRemove(),
+        )
         return ConversationHandler.END
 
     def cancel(self, update: Update, context: CallbackContext):
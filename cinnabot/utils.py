@@ -17,6 +17,7 @@ Note
 Guess who's secretly an OOP hoe,,, But also, python isn't java and shouldn't be treated as such!
 We can see how this plays out and ditch it if it's more trouble than it's worth HAHA.
 """
+import inspect
 import logging
 
 from abc import ABC, abstractmethod
@@ -24,6 +25,8 @@ from abc import ABC, abstractmethod
 from telegram import Update
 from telegram.ext import CallbackContext, CommandHandler
 
+from cinnabot.aio import runtime
+
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', 
     level=logging.INFO,
@@ -44,6 +47,7 @@ class Command(ABC):
         A detailed user guide for /help <function>
     callback(update: Update, context: CallbackContext) -> None
         The callback to handle this command. Feature implementation goes here.
+        May be a coroutine function, which is run by `cinnabot.aio.runtime`.
     """
 
     @property
@@ -56,7 +60,10 @@ class Command(ABC):
         user_id = update.message.from_user.id
         command = '/' + self.command + ' ' + ' '.join(context.args)
         logger.info(f'{user_id}: {command}')
-        return self.callback(update, context)
+        result = self.callback(update, context)
+        if inspect.iscoroutine(result):
+            return runtime.submit(result, update)
+        return result
 
     @property
     @abstractmethod
@@ -83,6 +90,12 @@ class Command(ABC):
 
 
 class Conversation(ABC):
+    """Interface for implementing a multi-step conversation.
+
+    Callbacks in the handler may be coroutine functions decorated with
+    `cinnabot.aio.asynchronous`, and their states are picked up once they finish.
+    """
+
     @property
     @abstractmethod
     def handler(self):
@@ -1,12 +1,20 @@
+# Base imports
+import os
+
 # 3rd party imports
-from telegram.ext import PicklePersistence, Updater, CallbackQueryHandler
+from telegram.ext import CallbackQueryHandler, InlineQueryHandler
 
 # Local imports
+from cinnabot.aio import runtime
+from cinnabot.assets import file_ids, store
 from cinnabot.base import Start, About, Help
 from cinnabot.claims import Claims
 from cinnabot.feedback import Feedback
+from cinnabot.persistence import SQLitePersistence, incremental_updater
 from cinnabot.resources import Resources
-from cinnabot.spaces import Spaces
+from cinnabot.sharding import sharded_updater
+from cinnabot.spaces import Spaces, FirestoreEventSource
+from cinnabot.sqlite_events import SQLiteEventSource
 from cinnabot.travel import NUSMap
 from cinnabot.supper import Supper
 from google.cloud.firestore import Client
@@ -19,11 +27,26 @@ firestore = Client(
 	credentials=AnonymousCredentials(),
 )
 
+# Pick where /spaces reads bookings from
+if os.environ.get('SPACES_BACKEND') == 'sqlite':
+	events = SQLiteEventSource(firestore, path=os.environ.get('SPACES_SQLITE_PATH', 'events.sqlite3'))
+else:
+	events = FirestoreEventSource(
+		firestore,
+		query_strategy=os.environ.get('SPACES_QUERY_STRATEGY', FirestoreEventSource.RANGE_QUERY),
+	)
+
+spaces = Spaces(source=events)
+
+# Read every image into memory now, so a missing or broken one stops the bot from starting
+ASSETS = Claims.assets() + NUSMap.assets()
+store.load(ASSETS)
+
 # Initialize to check that all requirements defined in utils.py have been met.
 FEATURES = [
 	Start(), 
 	About(),
-	Spaces(database=firestore),
+	spaces,
 	Claims(),
 	Resources(),
 	Feedback(),
@@ -34,8 +57,27 @@ FEATURES = [
 
 def make_cinnabot(token):
 	"""Helps initialize an updater with our features"""
+	# Keep conversations and chat data across restarts, writing only what changed every few seconds
+	# bot_data only holds the help texts, which are rebuilt below, so it is not persisted
+	persistence = SQLitePersistence(os.environ.get('PERSISTENCE_PATH', 'cinnabot.sqlite3'), store_bot_data=False)
+	persistence.start()
+	spaces.restore_subscriptions(persistence)
+
+	# Let coroutine handlers (/spaces, /claims) run concurrently instead of one update at a time
+	# Each of them may be calling the bot, so the bot gets a connection for every one
+	concurrency = int(os.environ.get('ASYNC_CONCURRENCY', 0))
+
 	# The updater primarily gets telegram updates from telegram servers
-	updater = Updater(token)
+	# With DISPATCHER_SHARDS, chats are handled in parallel (each one still in order)
+	shards = int(os.environ.get('DISPATCHER_SHARDS', 0))
+	if shards:
+		updater = sharded_updater(token, shards, persistence=persistence, connections=concurrency)
+		updater.job_queue.run_repeating(updater.dispatcher.log_stats, 600, first=600)
+	else:
+		updater = incremental_updater(token, persistence, connections=concurrency)
+
+	if concurrency:
+		runtime.start(concurrency)
 
 	# The dispatcher routes updates to the first matching handler
 	for feature in FEATURES:
@@ -48,6 +90,20 @@ def make_cinnabot(token):
 		updater.dispatcher.bot_data['help_text'][feature.command] = feature.help_text
 		updater.dispatcher.bot_data['help_full'][feature.command] = feature.help_full
 
+	# Flip through pages of long /spaces messages
+	updater.dispatcher.add_handler(CallbackQueryHandler(spaces.page_callback, pattern=Spaces.PAGE_PATTERN))
+
+	# Share bookings into any chat with '@cinnabot spaces today/week/now'
+	updater.dispatcher.add_handler(InlineQueryHandler(spaces.inline_query, pattern=Spaces.INLINE_PATTERN))
+
+	# Pre-render the most requested /spaces views at midnight and whenever bookings change
+	spaces.schedule_jobs(updater.job_queue)
+
+	# Upload every image once up front (to a chat the bot can post in) so users only ever get file_ids
+	warm_chat_id = os.environ.get('ASSET_WARMUP_CHAT_ID')
+	if warm_chat_id:
+		updater.job_queue.run_once(lambda context: file_ids.warm(context.bot, int(warm_chat_id), ASSETS), 0)
+
 	return updater
 
 if __name__ == '__main__':
@@ -62,7 +118,6 @@ if __name__ == '__main__':
 	
 	# Deploy using webhooks if on server
 	try:
-		import os
 		TOKEN = os.environ['TOKEN']
 		HOST = os.environ['HOST']
 		PORT = os.environ.get('PORT', 5000)
@@ -0,0 +1,83 @@
+"""Backfills the `daysCovered` field used by the day-bucketed /spaces query strategy.
+
+Every event document gets a sorted list of the UTC days ('YYYY-MM-DD') its booking touches,
+which lets `Spaces` fetch only events overlapping a window with `array_contains_any`.
+Documents whose field is already correct are left alone, so this is safe to re-run as a
+periodic maintenance job for bookings created after the initial backfill.
+
+When a run finishes, the time it started is recorded in a marker document. Bookings made
+later may lack the field, so `Spaces` only uses the buckets for windows ending before then.
+
+Usage (from the repository root, with credentials that can write to firestore):
+
+    python -m scripts.backfill_days_covered --project usc-website-206715 [--dry-run]
+"""
+import argparse
+from datetime import datetime
+import logging
+
+from google.cloud.firestore import Client
+import pytz
+
+from cinnabot.spaces import FirestoreEventSource, days_covered
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO,
+)
+
+logger = logging.getLogger(__name__)
+
+# Firestore rejects batches with more than 500 writes
+BATCH_SIZE = 500
+
+
+def backfill(db: Client, dry_run: bool = False):
+    """Writes `daysCovered` to every event missing it or carrying a stale value."""
+    started = pytz.UTC.localize(datetime.utcnow())
+    scanned = updated = 0
+    batch = db.batch()
+    pending = 0
+
+    events = db.collection('events').select(['startDate', 'endDate', 'daysCovered']).stream()
+    for event in events:
+        scanned += 1
+        data = event.to_dict()
+        if data.get('startDate') is None or data.get('endDate') is None:
+            logger.warning(f'Skipping {event.id}: missing startDate/endDate')
+            continue
+
+        days = days_covered(data['startDate'], data['endDate'])
+        if data.get('daysCovered') == days:
+            continue
+
+        updated += 1
+        if dry_run:
+            logger.info(f'{event.id}: {days}')
+            continue
+
+        batch.update(event.reference, {'daysCovered': days})
+        pending += 1
+        if pending == BATCH_SIZE:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+
+    if pending:
+        batch.commit()
+
+    # Every booking that existed when the scan started now has the field
+    if not dry_run:
+        collection, document = FirestoreEventSource.BACKFILL_MARKER
+        db.collection(collection).document(document).set({'backfilledAt': started})
+
+    logger.info(f'Scanned {scanned} events, {"would update" if dry_run else "updated"} {updated}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--project', default='usc-website-206715', help='firestore project id')
+    parser.add_argument('--dry-run', action='store_true', help='log changes without writing them')
+    args = parser.parse_args()
+
+    backfill(Client(project=args.project), dry_run=args.dry_run)
@@ -0,0 +1,130 @@
+"""Shrinks the images the bot sends and records them in an asset manifest.
+
+Telegram downscales photos to 1280px on the longest side and recompresses them as JPEG, so
+anything bigger is wasted upload time. Every image under the asset directories is resized to
+fit, flattened onto white, re-encoded as a metadata-free progressive JPEG and written under
+`cinnabot/optimized/`. The manifest maps each source path to its optimized copy along with the
+content hashes of both, which `cinnabot.assets.resolve` uses to serve the optimized copy while
+it is still current. Sources that do not get smaller are mapped to themselves.
+
+The sources that have an optimized copy are listed in `.slugignore`, so they stay in git for
+this script but are left out of the deployed slug.
+
+Unchanged sources are skipped, so this is cheap to re-run after adding or editing an image.
+
+Usage (from the repository root):
+
+    python -m scripts.optimize_assets [--max-side 1280] [--quality 85] [--force]
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+from cinnabot.assets import ASSET_DIRS, MANIFEST_PATH, OPTIMIZED_DIR
+
+SLUGIGNORE_PATH = Path('.slugignore')
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO,
+)
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png'}
+
+
+def sha256(data: bytes):
+    return hashlib.sha256(data).hexdigest()
+
+
+def optimize_image(data: bytes, max_side: int, quality: int):
+    """Returns (JPEG bytes, width, height) of an image resized to fit max_side, without metadata."""
+    image = Image.open(io.BytesIO(data))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    # Telegram sends photos as JPEG anyway, so transparency is flattened onto white
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return output.getvalue(), image.width, image.height
+
+
+def build(max_side: int = 1280, quality: int = 85, force: bool = False):
+    """Optimizes every image under ASSET_DIRS and rewrites the manifest."""
+    try:
+        old_manifest = json.loads(MANIFEST_PATH.read_text())
+    except FileNotFoundError:
+        old_manifest = dict()
+
+    manifest = dict()
+    before = after = 0
+    for directory in ASSET_DIRS:
+        for source in sorted(Path(directory).rglob('*')):
+            if source.suffix.lower() not in IMAGE_SUFFIXES:
+                continue
+            key = source.as_posix()
+            data = source.read_bytes()
+            source_hash = sha256(data)
+            before += len(data)
+
+            entry = old_manifest.get(key)
+            if not force and entry and entry['source_sha256'] == source_hash and Path(entry['path']).exists():
+                manifest[key] = entry
+                after += entry['size']
+                continue
+
+            optimized, width, height = optimize_image(data, max_side, quality)
+            if len(optimized) >= len(data):
+                logger.info(f'{key}: already small, keeping the original')
+                manifest[key] = {'path': key, 'sha256': source_hash, 'source_sha256': source_hash, 'size': len(data)}
+                after += len(data)
+                continue
+
+            target = OPTIMIZED_DIR / source.relative_to('cinnabot').with_suffix('.jpg')
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(optimized)
+            logger.info(f'{key}: {len(data) // 1024}KB -> {len(optimized) // 1024}KB at {width}x{height}')
+            manifest[key] = {
+                'path': target.as_posix(),
+                'sha256': sha256(optimized),
+                'source_sha256': source_hash,
+                'size': len(optimized),
+            }
+            after += len(optimized)
+
+    # Drop optimized copies of sources that no longer exist
+    kept = {Path(entry['path']) for entry in manifest.values()}
+    for stale in OPTIMIZED_DIR.rglob('*.jpg'):
+        if stale not in kept:
+            logger.info(f'Removing stale {stale.as_posix()}')
+            stale.unlink()
+
+    MANIFEST_PATH.parent.mkdir(parents=True, exist_ok=True)
+    MANIFEST_PATH.write_text(json.dumps(manifest, indent=2, sort_keys=True) + '\n')
+    replaced = sorted(source for source, entry in manifest.items() if entry['path'] != source)
+    SLUGIGNORE_PATH.write_text(''.join(f'{source}\n' for source in replaced))
+    logger.info(f'{len(manifest)} assets: {before // 1024}KB -> {after // 1024}KB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-side', type=int, default=1280, help='longest side in pixels')
+    parser.add_argument('--quality', type=int, default=85, help='JPEG quality')
+    parser.add_argument('--force', action='store_true', help='re-encode unchanged sources too')
+    args = parser.parse_args()
+
+    build(max_side=args.max_side, quality=args.quality, force=args.force)